@@ -0,0 +1,189 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mcp_server"))
+from backends import HashingEmbedder
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Azure OpenAI compatible stand-in for chat completions and embeddings.
+
+    Every request sleeps for the configured latency (plus jitter) before answering, so the
+    agent and the indexer see realistic wait times without calling a model. JSON responses
+    contain the fields of all of the agent's JSON prompts, embeddings come from the
+    deterministic local embedder. With throttle_rate, that share of the requests is answered
+    with 429 and a Retry-After-ms header like a deployment at its quota. Streamed chat
+    completions send their first chunk after first_token_share of the latency and spread the
+    rest of it over the following chunks.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, chat_latency: float = 0.5, embedding_latency: float = 0.05,
+                 jitter: float = 0.1, summary_words: int = 200, embedding_dimensions: int = 3072,
+                 throttle_rate: float = 0.0, retry_after_ms: int = 100, first_token_share: float = 0.1):
+        super().__init__(address, FakeOpenAIHandler)
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.jitter = jitter
+        self.summary_words = summary_words
+        self.embedder = HashingEmbedder(embedding_dimensions)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+        self.first_token_share = first_token_share
+        self.requests = {"chat": 0, "embeddings": 0, "throttled": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self, latency: float):
+        time.sleep(max(0.0, latency * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def throttle(self) -> bool:
+        if self.throttle_rate <= 0 or random.random() >= self.throttle_rate:
+            return False
+        with self._lock:
+            self.requests["throttled"] += 1
+        return True
+
+    def chat_completion(self, body: dict) -> dict:
+        with self._lock:
+            self.requests["chat"] += 1
+            n = next(self._counter)
+        # Vary the queries, otherwise every loop would hit the embedding cache
+        aspect = ["features", "maintenance", "energy use", "programs", "troubleshooting"][n % 5]
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            queries = [{"query": f"{aspect} query {n}.{i}", "aspect": aspect, "rationale": "benchmark"} for i in range(5)]
+            content = json.dumps({
+                "query": queries[0]["query"], "aspect": aspect, "rationale": "benchmark", "queries": queries,
+                "knowledge_gap": aspect, "follow_up_query": f"follow-up {aspect} query {n}",
+                "knowledge_gaps": [{"knowledge_gap": aspect, "follow_up_query": f"follow-up {aspect} query {n}.{i}"} for i in range(5)]
+            })
+        else:
+            content = " ".join(f"summary{(n + i) % 97}" for i in range(self.summary_words))
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-fake-{n}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def embeddings(self, body: dict) -> dict:
+        with self._lock:
+            self.requests["embeddings"] += 1
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = self.embedder.embed(texts)
+        tokens = sum(len(text) for text in texts) // 4
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)],
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+        if self.server.throttle():
+            data = json.dumps({"error": {"code": "429", "message": "Rate limit is exceeded."}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After-Ms", str(self.server.retry_after_ms))
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if path.endswith("/chat/completions") and body.get("stream"):
+            self.stream_chat_completion(body)
+            return
+        if path.endswith("/chat/completions"):
+            self.server.delay(self.server.chat_latency)
+            response = self.server.chat_completion(body)
+        elif path.endswith("/embeddings"):
+            self.server.delay(self.server.embedding_latency)
+            response = self.server.embeddings(body)
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_chat_completion(self, body: dict, words_per_chunk: int = 5):
+        response = self.server.chat_completion(body)
+        words = response["choices"][0]["message"]["content"].split(" ")
+        pieces = [" ".join(words[i:i + words_per_chunk]) + " " for i in range(0, len(words), words_per_chunk)]
+        pieces[-1] = pieces[-1][:-1]
+        chunk = {key: response[key] for key in ("id", "created", "model")}
+        chunk["object"] = "chat.completion.chunk"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        latency = self.server.chat_latency
+        self.server.delay(latency * self.server.first_token_share)
+        for i, piece in enumerate(pieces):
+            finish_reason = "stop" if i == len(pieces) - 1 else None
+            self.send_event(dict(chunk, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": finish_reason}]))
+            if i < len(pieces) - 1:
+                self.server.delay(latency * (1 - self.server.first_token_share) / (len(pieces) - 1))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.send_event(dict(chunk, choices=[], usage=response["usage"]))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_event(self, data: dict):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_openai_server(port: int = 0, **kwargs) -> FakeOpenAIServer:
+    """Starts the server on a background thread, port 0 picks a free port."""
+    server = FakeOpenAIServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Azure OpenAI server with configurable latency.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds per chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative latency jitter")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args()
+    server = FakeOpenAIServer(("127.0.0.1", args.port), chat_latency=args.chat_latency,
+                              embedding_latency=args.embedding_latency, jitter=args.jitter,
+                              throttle_rate=args.throttle_rate)
+    print(f"Fake Azure OpenAI server listening on {server.url}")
+    server.serve_forever()
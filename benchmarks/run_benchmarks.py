@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_openai_server import start_fake_openai_server
+from backends import HashingEmbedder, LocalVectorStore
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MCP_SERVER_DIR = os.path.join(ROOT, "mcp_server")
+AGENT_DIR = os.path.join(ROOT, "langgraph_agent")
+
+SCENARIOS = ["indexing", "single_run", "concurrent", "node_breakdown", "streaming", "quantization"]
+# Quantization and embedding dimensions of the collection profiles compared by the quantization scenario
+PROFILES = ["none:3072", "scalar:3072", "binary:3072", "none:1024", "scalar:1024", "binary:1024"]
+
+WORDS = ("washing machine detergent drum dryer filter lint program temperature wool cotton spin speed "
+         "door seal water pressure error code app wifi energy label eco load sensor steam care").split()
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_corpus(directory: str, num_docs: int, paragraphs: int, seed: int = 42):
+    """Writes num_docs synthetic manuals of random product vocabulary."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(num_docs):
+        with open(os.path.join(directory, f"manual_{i:04d}.txt"), 'w', encoding="utf-8") as f:
+            f.write("\n\n".join(" ".join(rng.choice(WORDS) for _ in range(80)) for _ in range(paragraphs)))
+
+
+def backend_env(openai_url: str, work_dir: str) -> dict:
+    """Environment of the indexer and the MCP server: local vector store, embeddings from the fake server."""
+    env = dict(os.environ)
+    env.update({
+        "VECTOR_STORE": "local",
+        "LOCAL_VECTOR_STORE_PATH": os.path.join(work_dir, "store"),
+        "EMBEDDER": "azure",
+        "AZURE_OPENAI_ENDPOINT": openai_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_API_VERSION": "2024-06-01",
+        "AZURE_OPENAI_EMBEDDING_MODEL": "fake-embedding",
+        "DOCS_SUBFOLDER": os.path.join(work_dir, "docs"),
+        "INDEX_MANIFEST_PATH": os.path.join(work_dir, "manifest.json"),
+        "INDEX_INCREMENTAL": "False",
+    })
+    return env
+
+
+def bench_indexing(env: dict) -> dict:
+    """Runs the indexer over the corpus and measures its end-to-end throughput."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "index-documents.py"], cwd=MCP_SERVER_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(env["LOCAL_VECTOR_STORE_PATH"], "payloads.jsonl"), encoding="utf-8") as f:
+        chunks = sum(1 for _ in f)
+    return {"chunks": chunks, "seconds": round(elapsed, 3), "chunks_per_sec": round(chunks / elapsed, 1)}
+
+
+@contextlib.contextmanager
+def local_mcp_server(env: dict):
+    """Runs mcp_server.py on the indexed local corpus and yields its URL."""
+    port = free_port()
+    server_env = dict(env, MCP_SERVER_HOST="127.0.0.1", MCP_SERVER_PORT=str(port))
+    process = subprocess.Popen([sys.executable, "mcp_server.py"], cwd=MCP_SERVER_DIR, env=server_env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("MCP server exited during startup")
+            with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError("MCP server did not start within 30s")
+            time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}/mcp"
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def create_agent(openai_url: str, mcp_url: str, loops: int):
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": openai_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_API_VERSION": "2024-06-01",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "fake-chat",
+        # The fake server accepts stream_options with any API version
+        "LLM_STREAM_USAGE": "True",
+        "MAX_RESEARCH_LOOPS": str(loops),
+        "MCP_SERVER_URL": mcp_url,
+    })
+    if AGENT_DIR not in sys.path:
+        sys.path.insert(0, AGENT_DIR)
+    from agent import AgentConfig, ResearchAgent
+    return ResearchAgent(AgentConfig())
+
+
+def bench_single_run(agent, runs: int) -> dict:
+    """Latency of sequential runs of the synchronous graph."""
+    graph = agent.build_graph()
+    latencies = []
+    for i in range(runs):
+        start = time.perf_counter()
+        agent.invoke(graph, {"research_topic": f"Benchmark topic {i}"})
+        latencies.append(time.perf_counter() - start)
+    return {
+        "runs": runs,
+        "mean_seconds": round(sum(latencies) / runs, 3),
+        "p50_seconds": round(percentile(latencies, 50), 3),
+        "p90_seconds": round(percentile(latencies, 90), 3),
+    }
+
+
+def bench_concurrent(agent, runs: int, concurrency: int) -> dict:
+    """Throughput of the async graph with a bounded number of runs in flight."""
+    async def run_all():
+        graph = agent.build_graph(use_async=True)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def run_one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await agent.ainvoke(graph, {"research_topic": f"Concurrent benchmark topic {i}"})
+                latencies.append(time.perf_counter() - start)
+
+        try:
+            await asyncio.gather(*(run_one(i) for i in range(runs)))
+        finally:
+            await agent.aclose()
+        return latencies
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    return {
+        "runs": runs,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "runs_per_min": round(60 * runs / elapsed, 2),
+        "p50_seconds": round(percentile(latencies, 50), 3),
+        "p90_seconds": round(percentile(latencies, 90), 3),
+    }
+
+
+def bench_node_breakdown(agent, runs: int) -> dict:
+    """Mean wall time per node, measured between the graph's update events."""
+    graph = agent.build_graph()
+    totals, counts = {}, {}
+    for i in range(runs):
+        last = time.perf_counter()
+        # A thread_id in case CHECKPOINT_PATH is set, the graph ignores it otherwise
+        config = {"configurable": {"thread_id": f"breakdown-{time.time_ns()}-{i}"}}
+        for update in graph.stream({"research_topic": f"Breakdown topic {i}"}, config, stream_mode="updates"):
+            now = time.perf_counter()
+            for node in update:
+                totals[node] = totals.get(node, 0.0) + now - last
+                counts[node] = counts.get(node, 0) + 1
+            last = now
+    return {f"{node}_mean_seconds": round(totals[node] / counts[node], 4) for node in totals}
+
+
+def bench_streaming(agent, runs: int) -> dict:
+    """Time to the first node event and the first summary token of streamed runs, against the full run."""
+    graph = agent.build_graph()
+    first_events, first_tokens, latencies = [], [], []
+    for i in range(runs):
+        start = time.perf_counter()
+        first_token = None
+        for n, event in enumerate(agent.stream(graph, {"research_topic": f"Streaming topic {i}"})):
+            if n == 0:
+                first_events.append(time.perf_counter() - start)
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+        latencies.append(time.perf_counter() - start)
+        first_tokens.append(first_token)
+    return {
+        "runs": runs,
+        "first_event_p50_seconds": round(percentile(first_events, 50), 3),
+        "first_token_p50_seconds": round(percentile(first_tokens, 50), 3),
+        "p50_seconds": round(percentile(latencies, 50), 3),
+    }
+
+
+def bench_quantization(work_dir: str, profiles: list, num_chunks: int, num_queries: int, oversampling: float,
+                       embeddings_path: str = None, limit: int = 10, seed: int = 7) -> dict:
+    """Recall, query latency and vector memory of every collection profile.
+
+    The ground truth is an exact float32 search at full dimensions. Reduced dimensions are
+    measured by cutting the embeddings, which is how the dimensions parameter of Matryoshka
+    trained models like text-embedding-3 shortens them. That only holds for real embeddings
+    loaded from embeddings_path (an .npz file with "chunks" and "queries" arrays); the
+    synthetic feature-hashing vectors lose arbitrary features when cut, so reduced-dimension
+    profiles are skipped for them.
+    """
+    import numpy as np
+    if embeddings_path:
+        with np.load(embeddings_path) as data:
+            vectors = np.asarray(data["chunks"], dtype=np.float32)
+            query_vectors = np.asarray(data["queries"], dtype=np.float32)
+    else:
+        rng = random.Random(seed)
+        embedder = HashingEmbedder(3072)
+        chunks = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 160))) for _ in range(num_chunks)]
+        queries = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))) for _ in range(num_queries)]
+        vectors = np.asarray(embedder.embed(chunks), dtype=np.float32)
+        query_vectors = np.asarray(embedder.embed(queries), dtype=np.float32)
+    full_dimensions = vectors.shape[1]
+    ids = [str(i) for i in range(len(vectors))]
+    payloads = [{} for _ in ids]
+
+    exact = LocalVectorStore()
+    exact.upsert(ids, vectors, payloads)
+    truth = [{hit.id for hit in hits} for hits in exact.search_batch(query_vectors, limit)]
+
+    results = {}
+    for profile in profiles:
+        quantization, dimensions = profile.split(":")
+        quantization = None if quantization == "none" else quantization
+        dimensions = int(dimensions)
+        if dimensions > full_dimensions:
+            print(f"quantization: skipping {profile}, the embeddings have {full_dimensions} dimensions", file=sys.stderr)
+            continue
+        if dimensions < full_dimensions and not embeddings_path:
+            print(f"quantization: skipping {profile}, cut synthetic embeddings say nothing about recall "
+                  "(pass --embeddings)", file=sys.stderr)
+            continue
+        path = os.path.join(work_dir, f"profile_{quantization}_{dimensions}")
+        store = LocalVectorStore(path)
+        store.upsert(ids, vectors[:, :dimensions], payloads)
+        store.persist()
+        if quantization:
+            # Served like in production: originals memory-mapped, only the quantized vectors in RAM
+            store = LocalVectorStore(path, quantization=quantization, oversampling=oversampling)
+        latencies, recalls = [], []
+        store.search(query_vectors[0, :dimensions], limit)
+        for query_vector, expected in zip(query_vectors, truth):
+            start = time.perf_counter()
+            hits = store.search(query_vector[:dimensions], limit)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(expected & {hit.id for hit in hits}) / limit)
+        name = f"{quantization or 'float32'}_{dimensions}d"
+        results[f"{name}_recall_at_{limit}"] = round(sum(recalls) / len(recalls), 4)
+        results[f"{name}_p50_ms"] = round(1000 * percentile(latencies, 50), 3)
+        results[f"{name}_p90_ms"] = round(1000 * percentile(latencies, 90), 3)
+        results[f"{name}_ram_mb"] = round(store.memory_bytes() / 1024 / 1024, 2)
+    return results
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """Returns a message per metric that got worse than the baseline by more than max_regression."""
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(scenario, {}).get(metric)
+            if not isinstance(previous, (int, float)) or not previous or metric in ("runs", "concurrency", "chunks"):
+                continue
+            higher_is_better = "_per_" in metric or "_recall_" in metric
+            change = (previous - value) / previous if higher_is_better else (value - previous) / previous
+            if change > max_regression:
+                regressions.append(f"{scenario}.{metric}: {previous} -> {value} ({100 * change:.0f}% worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the indexer and the research graph against local stand-ins.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--docs", type=int, default=50, help="Number of synthetic documents")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per document")
+    parser.add_argument("--loops", type=int, default=2, help="MAX_RESEARCH_LOOPS of the agent")
+    parser.add_argument("--runs", type=int, default=5, help="Graph runs per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Runs in flight in the concurrent scenario")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Seconds per fake chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Seconds per fake embedding request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of fake requests answered with 429")
+    parser.add_argument("--profiles", nargs="+", default=PROFILES, help="quantization:dimensions profiles to compare")
+    parser.add_argument("--quantization-chunks", type=int, default=5000, help="Chunks of the quantization scenario")
+    parser.add_argument("--quantization-queries", type=int, default=100, help="Queries of the quantization scenario")
+    parser.add_argument("--embeddings", help="npz file with real chunk and query embeddings for the quantization scenario")
+    parser.add_argument("--oversampling", type=float, default=2.0, help="Oversampling of quantized searches")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--baseline", help="Results of an earlier run to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Tolerated relative regression (default: 0.2)")
+    args = parser.parse_args()
+
+    openai_server = start_fake_openai_server(chat_latency=args.chat_latency, embedding_latency=args.embedding_latency,
+                                             throttle_rate=args.throttle_rate)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = backend_env(openai_server.url, work_dir)
+        build_corpus(env["DOCS_SUBFOLDER"], args.docs, args.paragraphs)
+        # The graph scenarios need an indexed corpus even if indexing is not measured
+        indexing = bench_indexing(env)
+        if "indexing" in args.scenarios:
+            results["indexing"] = indexing
+            print(f"indexing: {indexing}", file=sys.stderr)
+
+        if "quantization" in args.scenarios:
+            results["quantization"] = bench_quantization(work_dir, args.profiles, args.quantization_chunks,
+                                                         args.quantization_queries, args.oversampling, args.embeddings)
+            print(f"quantization: {results['quantization']}", file=sys.stderr)
+
+        graph_scenarios = [scenario for scenario in args.scenarios if scenario not in ("indexing", "quantization")]
+        if graph_scenarios:
+            with local_mcp_server(env) as mcp_url:
+                agent = create_agent(openai_server.url, mcp_url, args.loops)
+                # The nodes print every prompt and result
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    try:
+                        for scenario in graph_scenarios:
+                            if scenario == "single_run":
+                                results[scenario] = bench_single_run(agent, args.runs)
+                            elif scenario == "concurrent":
+                                results[scenario] = bench_concurrent(agent, args.runs * args.concurrency, args.concurrency)
+                            elif scenario == "node_breakdown":
+                                results[scenario] = bench_node_breakdown(agent, args.runs)
+                            elif scenario == "streaming":
+                                results[scenario] = bench_streaming(agent, args.runs)
+                            print(f"{scenario}: {results[scenario]}", file=sys.stderr)
+                    finally:
+                        agent.close()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    with open(args.output, 'w', encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
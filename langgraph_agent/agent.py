@@ -12,126 +12,738 @@ class AgentConfig:
         self.api_version = os.environ["AZURE_OPENAI_API_VERSION"]
         self.max_research_loops = int(os.environ["MAX_RESEARCH_LOOPS"])
         self.mcp_server_url = os.environ["MCP_SERVER_URL"]
+        # Number of search queries generated and researched concurrently per loop
+        self.queries_per_loop = max(1, int(os.environ.get("QUERIES_PER_LOOP", "1")))
+        # New chunks handed to the summarizer per query and per loop
+        self.docs_per_query = int(os.environ.get("DOCS_PER_QUERY") or 5)
+        # Let the MCP server rerank the retrieved chunks for diversity, dropping near-duplicates
+        self.retrieval_mmr = os.environ.get("RETRIEVAL_MMR", "False").lower() in ("true", "1", "yes")
+        # Neighbor chunks before and after each hit that are returned with it as one passage
+        self.context_window = int(os.environ.get("CONTEXT_WINDOW") or 0)
+        # Upper limit of num_docs when over-fetching to make up for chunks seen in earlier loops
+        self.max_docs_per_query = int(os.environ.get("MAX_DOCS_PER_QUERY") or 25)
+        # A loop whose share of new, relevant chunks in the top results falls below this ends the research
+        self.novelty_threshold = float(os.environ.get("NOVELTY_THRESHOLD") or 0.2)
+        # Minimum search score for a new chunk to count as relevant
+        self.novelty_min_score = float(os.environ.get("NOVELTY_MIN_SCORE") or 0.0)
+        # Research loops that always run before the novelty check may end the research
+        self.min_research_loops = int(os.environ.get("MIN_RESEARCH_LOOPS") or 1)
+        # Number of MCP sessions kept open and reused across research loops
+        self.mcp_pool_size = int(os.environ.get("MCP_POOL_SIZE") or self.queries_per_loop)
+        # incremental: every loop adds a summary section, rewrite: every loop rewrites the whole summary
+        self.summary_mode = os.environ.get("SUMMARY_MODE", "incremental").lower()
+        # Prompt token caps per node and the tokenizer used to enforce them
+        self.summarizer_max_prompt_tokens = int(os.environ.get("SUMMARIZER_MAX_PROMPT_TOKENS") or 8000)
+        self.reflection_max_prompt_tokens = int(os.environ.get("REFLECTION_MAX_PROMPT_TOKENS") or 4000)
+        self.summary_context_tokens = int(os.environ.get("SUMMARY_CONTEXT_TOKENS") or 1000)
+        self.tokenizer_encoding = os.environ.get("TOKENIZER_ENCODING") or "o200k_base"
+        # SQLite file caching LLM responses, the cache is off if empty
+        self.llm_cache_path = os.environ.get("LLM_CACHE_PATH") or None
+        # readwrite: call the model on a miss and store the response, replay: fail on a miss
+        self.llm_cache_mode = os.environ.get("LLM_CACHE_MODE") or "readwrite"
+        self.llm_cache_max_mb = float(os.environ.get("LLM_CACHE_MAX_MB") or 256)
+        # Completion tokens reserved per LLM call by the rate limiter until the actual usage is known
+        self.llm_completion_tokens_estimate = int(os.environ.get("LLM_COMPLETION_TOKENS_ESTIMATE") or 1000)
+        # Request the usage of streamed completions (stream_options), which API versions before 2024-09-01-preview reject
+        stream_usage = os.environ.get("LLM_STREAM_USAGE")
+        if stream_usage:
+            self.llm_stream_usage = stream_usage.lower() in ("true", "1", "yes")
+        else:
+            self.llm_stream_usage = self.api_version[:10] >= "2024-09-01"
+        # SQLite file the graph state is checkpointed to after every node, checkpointing is off if empty
+        self.checkpoint_path = os.environ.get("CHECKPOINT_PATH") or None
+        # async: a checkpoint is written while the next node runs, sync: before the next node starts
+        self.checkpoint_durability = os.environ.get("CHECKPOINT_DURABILITY") or "async"
         self.debug = os.environ.get("DEBUG", "False").lower() in ("true", "1", "yes")
+        # JSONL file the node, LLM and MCP timings are appended to, tracing to a file is off if empty
+        self.trace_path = os.environ.get("TRACE_PATH") or None
+        # Prices per 1000 tokens used to estimate the cost of every LLM call
+        self.prompt_price_per_1k = float(os.environ.get("LLM_PROMPT_PRICE_PER_1K") or 0)
+        self.completion_price_per_1k = float(os.environ.get("LLM_COMPLETION_PRICE_PER_1K") or 0)
         # New config: print sources in finalize_summary
         self.print_sources_in_summary = os.environ.get("PRINT_SOURCES_IN_SUMMARY", "False").lower() in ("true", "1", "yes")
 
 
+class StreamInterruptedError(Exception):
+    """Raised when a streamed completion fails after some of its text was emitted.
+
+    The rate limiter does not retry it, a retry would emit the same text a second time.
+    """
+
+
 class ResearchAgent:
     def __init__(self, config: AgentConfig):
-        from openai import AzureOpenAI
+        from openai import AzureOpenAI, AsyncAzureOpenAI
         self.config = config
+        # Retries are left to the rate limiter, which the sync and the async client share
         self.client = AzureOpenAI(
             api_key=config.api_key,
             api_version=config.api_version,
             azure_endpoint=config.endpoint,
+            max_retries=0,
+        )
+        # Used by the nodes of the async graph, see build_graph(use_async=True)
+        self.async_client = AsyncAzureOpenAI(
+            api_key=config.api_key,
+            api_version=config.api_version,
+            azure_endpoint=config.endpoint,
+            max_retries=0,
+        )
+        from rate_limiter import create_rate_limiter
+        self.limiter = create_rate_limiter("LLM")
+        from instrumentation import Tracer
+        from token_budget import TokenBudget, TokenCounter
+        self.budget = TokenBudget(
+            TokenCounter(config.tokenizer_encoding),
+            summarizer_max_tokens=config.summarizer_max_prompt_tokens,
+            reflection_max_tokens=config.reflection_max_prompt_tokens,
+            summary_context_tokens=config.summary_context_tokens,
         )
+        self.tracer = Tracer(config.trace_path, config.prompt_price_per_1k, config.completion_price_per_1k)
+        self.llm_cache = None
+        if config.llm_cache_path:
+            from llm_cache import LLMResponseCache
+            self.llm_cache = LLMResponseCache(config.llm_cache_path, int(config.llm_cache_max_mb * 1024 * 1024), config.llm_cache_mode)
         # Import here to avoid circular imports
         from mcp_client.mcp_client import MCPClient
         self.MCPClient = MCPClient
+        # Opened on the first research loop and reused until close()
+        self.mcp_pool = None
+        # The async graph awaits the MCP sessions on the caller's event loop instead
+        self.async_mcp_pool = None
+        self._async_mcp_pool_loop = None
+        # Opened by build_graph if CHECKPOINT_PATH is set
+        self.checkpointer = None
+        # Like the async MCP sessions, the async checkpointer belongs to the loop it was opened on
+        self.async_checkpointer = None
+        self._async_checkpointer_loop = None
+        # ainvoke/astream calls in flight, the last one to finish closes the async sessions and checkpointer
+        self._async_runs = 0
 
-    def call_llm(self, messages: list, temperature: float = 0.7, json_response: bool = False):
-        if json_response:
-            response = self.client.chat.completions.create(
-                model=self.config.deployment_name,
-                messages=messages,
-                temperature=temperature,
-                response_format={"type": "json_object"}
-            )
+    def get_mcp_pool(self):
+        from mcp_client.mcp_client_pool import BlockingMCPClientPool
+        if self.mcp_pool is None:
+            self.mcp_pool = BlockingMCPClientPool(self.config.mcp_server_url, size=self.config.mcp_pool_size)
+        return self.mcp_pool
+
+    def get_async_mcp_pool(self):
+        import asyncio
+        from mcp_client.mcp_client_pool import MCPClientPool
+        loop = asyncio.get_running_loop()
+        # Sessions belong to the loop that opened them, a new loop (e.g. another asyncio.run) needs new ones
+        if self.async_mcp_pool is None or self._async_mcp_pool_loop is not loop:
+            self.async_mcp_pool = MCPClientPool(self.config.mcp_server_url, size=self.config.mcp_pool_size)
+            self._async_mcp_pool_loop = loop
+        return self.async_mcp_pool
+
+    def close(self):
+        """Closes the MCP sessions and the checkpoint database held by the agent."""
+        if self.mcp_pool is not None:
+            self.mcp_pool.close()
+            self.mcp_pool = None
+        if self.checkpointer is not None:
+            self.checkpointer.conn.close()
+            self.checkpointer = None
+
+    async def _aclose_async_resources(self):
+        # Detached first, so a run starting while they close opens new ones
+        pool, self.async_mcp_pool = self.async_mcp_pool, None
+        checkpointer, self.async_checkpointer = self.async_checkpointer, None
+        if pool is not None:
+            await pool.aclose()
+        if checkpointer is not None:
+            await checkpointer.conn.close()
+
+    async def _end_async_run(self):
+        self._async_runs -= 1
+        # Sessions and connections left open would outlive their loop (e.g. the end of asyncio.run)
+        if self._async_runs == 0:
+            await self._aclose_async_resources()
+
+    async def aclose(self):
+        """Closes the MCP sessions of the async graph, must run on the loop that used them."""
+        await self._aclose_async_resources()
+        self.close()
+
+    def get_async_checkpointer(self):
+        """Returns the SQLite checkpointer of the async graph for the running loop, None if checkpointing is off."""
+        import asyncio
+        path = self.config.checkpoint_path
+        if not path:
+            return None
+        loop = asyncio.get_running_loop()
+        # The saver and its connection are bound to the loop that created them, a new loop needs new ones
+        if self.async_checkpointer is None or self._async_checkpointer_loop is not loop:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            if self.async_checkpointer is not None:
+                # The loop of the old connection is gone, so it cannot be awaited; its thread closes it
+                self.async_checkpointer.conn.stop()
+            self.async_checkpointer = AsyncSqliteSaver(aiosqlite.connect(path))
+            self._async_checkpointer_loop = loop
+        return self.async_checkpointer
+
+    def _with_async_checkpointer(self, graph):
+        # The async graph is compiled without checkpointer, every run attaches the saver of its loop
+        if graph.checkpointer is not None:
+            return graph
+        checkpointer = self.get_async_checkpointer()
+        return graph if checkpointer is None else graph.copy(update={"checkpointer": checkpointer})
+
+    def get_checkpointer(self):
+        """Returns the SQLite checkpointer of the sync graph, None if checkpointing is off."""
+        path = self.config.checkpoint_path
+        if not path:
+            return None
+        if self.checkpointer is None:
+            import sqlite3
+            from langgraph.checkpoint.sqlite import SqliteSaver
+            conn = sqlite3.connect(path, check_same_thread=False)
+            # WAL (set by the saver) with synchronous=NORMAL only syncs at checkpoints of the WAL file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.checkpointer = SqliteSaver(conn)
+        return self.checkpointer
+
+    @staticmethod
+    def _checkpoint_thread(thread_id, research_input):
+        # The thread is namespaced with the topic, reusing an ID for another topic starts a new thread
+        import hashlib
+        topic_hash = hashlib.sha256(research_input["research_topic"].encode("utf-8")).hexdigest()[:16]
+        return f"{thread_id}:{topic_hash}"
+
+    def _run_config(self, graph, research_input, thread_id):
+        if graph.checkpointer is None:
+            return None
+        import uuid
+        # The checkpointer needs a thread, a run without thread_id gets a new one and cannot be resumed later
+        thread_id = self._checkpoint_thread(thread_id, research_input) if thread_id else uuid.uuid4().hex
+        return {"configurable": {"thread_id": thread_id}}
+
+    def _resume(self, snapshot, research_input, thread_id):
+        """Returns (finished, value): the stored final_summary of a finished thread, else the graph input.
+
+        A thread with pending nodes was interrupted and continues from its last checkpoint, a
+        thread without checkpoints starts with research_input.
+        """
+        if snapshot.values and snapshot.values.get("research_topic") != research_input["research_topic"]:
+            raise ValueError(f"Checkpoint thread {thread_id} belongs to the topic '{snapshot.values.get('research_topic')}'")
+        if snapshot.next:
+            print(f"Resuming run {thread_id} at {', '.join(snapshot.next)} (research loop {snapshot.values.get('research_loop_count', 0)})")
+            return False, None
+        if snapshot.values.get("final_summary"):
+            # Finished before, the output is read from the checkpoint
+            return True, snapshot.values["final_summary"]
+        return False, research_input
+
+    @staticmethod
+    async def _adelete_thread(graph, config):
+        # Unlike the other async methods, adelete_thread does not create the tables of a new database
+        await graph.checkpointer.setup()
+        await graph.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+    def invoke(self, graph, research_input, thread_id: str = None, restart: bool = False):
+        """Runs the graph, with a checkpointer an interrupted run of thread_id resumes from its last completed node.
+
+        Use this (or ainvoke) instead of graph.invoke when CHECKPOINT_PATH may be set: the
+        checkpointed graph needs a thread_id, which is generated if none is given. A thread_id
+        only resumes runs of the same research topic, and a finished run returns its stored
+        final_summary unless restart discards its checkpoints and runs it again.
+        """
+        config = self._run_config(graph, research_input, thread_id)
+        if config is None:
+            return graph.invoke(research_input)
+        if restart:
+            graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+        finished, value = self._resume(graph.get_state(config), research_input, thread_id)
+        if finished:
+            return {"final_summary": value}
+        return graph.invoke(value, config, durability=self.config.checkpoint_durability)
+
+    async def ainvoke(self, graph, research_input, thread_id: str = None, restart: bool = False):
+        """Async invoke for the graph of build_graph(use_async=True).
+
+        The MCP sessions and the checkpoint connection are shared by the runs in flight on the
+        loop and closed when the last of them finishes.
+        """
+        self._async_runs += 1
+        try:
+            graph = self._with_async_checkpointer(graph)
+            config = self._run_config(graph, research_input, thread_id)
+            if config is None:
+                return await graph.ainvoke(research_input)
+            if restart:
+                await self._adelete_thread(graph, config)
+            finished, value = self._resume(await graph.aget_state(config), research_input, thread_id)
+            if finished:
+                return {"final_summary": value}
+            return await graph.ainvoke(value, config, durability=self.config.checkpoint_durability)
+        finally:
+            await self._end_async_run()
+
+    def _stream_config(self, graph, research_input, thread_id):
+        config = self._run_config(graph, research_input, thread_id) or {"configurable": {}}
+        config["configurable"]["stream_tokens"] = True
+        return config
+
+    def _stream_options(self, graph):
+        options = {"stream_mode": ["tasks", "custom"]}
+        # LangGraph warns about durability on every run of a graph without checkpointer
+        if graph.checkpointer is not None:
+            options["durability"] = self.config.checkpoint_durability
+        return options
+
+    @staticmethod
+    def _stream_events(mode: str, data, filters: dict):
+        """Turns a task or custom event of the graph stream into progress and token events.
+
+        Tokens go through a ThinkingFilter per node, which is flushed when the node finishes.
+        """
+        from helper import ThinkingFilter
+        if mode == "custom":
+            text = filters.setdefault(data["node"], ThinkingFilter()).feed(data["token"])
+            if text:
+                yield {"type": "token", "node": data["node"], "text": text}
+        elif "result" not in data:
+            yield {"type": "node_start", "node": data["name"]}
         else:
-            response = self.client.chat.completions.create(
-                model=self.config.deployment_name,
-                messages=messages,
-                temperature=temperature
-            )
-        return response.choices[0].message.content
+            if data["name"] in filters:
+                text = filters.pop(data["name"]).flush()
+                if text:
+                    yield {"type": "token", "node": data["name"], "text": text}
+            yield {"type": "node_end", "node": data["name"], "update": data["result"], "error": data["error"]}
 
-    def generate_query(self, state):
-        from prompts import query_writer_prompt
-        import json
-        query_writer_instructions_formatted = query_writer_prompt.format(research_topic=state.research_topic)
+    @staticmethod
+    def _result_event(final_summary):
+        from helper import strip_thinking_tokens
+        return {"type": "result", "final_summary": strip_thinking_tokens(final_summary) if final_summary else final_summary}
+
+    def stream(self, graph, research_input, thread_id: str = None, restart: bool = False):
+        """Runs the graph like invoke and yields its progress as it happens.
+
+        Yields node_start and node_end events per node, token events with the text that
+        summarize_sources and finalize_summary produce (thinking blocks removed) and finally a
+        result event with the final_summary, also without thinking blocks.
+        """
+        config = self._stream_config(graph, research_input, thread_id)
+        if graph.checkpointer is not None:
+            if restart:
+                graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+            finished, research_input = self._resume(graph.get_state(config), research_input, thread_id)
+            if finished:
+                yield self._result_event(research_input)
+                return
+        filters, final_summary = {}, None
+        for mode, data in graph.stream(research_input, config, **self._stream_options(graph)):
+            for event in self._stream_events(mode, data, filters):
+                if event["type"] == "node_end" and event["node"] == "finalize_summary":
+                    final_summary = event["update"]["final_summary"]
+                yield event
+        yield self._result_event(final_summary)
+
+    async def astream(self, graph, research_input, thread_id: str = None, restart: bool = False):
+        """Async stream for the graph of build_graph(use_async=True)."""
+        self._async_runs += 1
+        try:
+            graph = self._with_async_checkpointer(graph)
+            config = self._stream_config(graph, research_input, thread_id)
+            if graph.checkpointer is not None:
+                if restart:
+                    await self._adelete_thread(graph, config)
+                finished, research_input = self._resume(await graph.aget_state(config), research_input, thread_id)
+                if finished:
+                    yield self._result_event(research_input)
+                    return
+            filters, final_summary = {}, None
+            async for mode, data in graph.astream(research_input, config, **self._stream_options(graph)):
+                for event in self._stream_events(mode, data, filters):
+                    if event["type"] == "node_end" and event["node"] == "finalize_summary":
+                        final_summary = event["update"]["final_summary"]
+                    yield event
+            yield self._result_event(final_summary)
+        finally:
+            await self._end_async_run()
+
+    def _llm_request(self, messages: list, temperature: float, json_response: bool):
+        request = {
+            "model": self.config.deployment_name,
+            "messages": messages,
+            "temperature": temperature
+        }
+        if json_response:
+            request["response_format"] = {"type": "json_object"}
+        return request
+
+    def _estimated_tokens(self, request: dict) -> int:
+        # Azure counts the prompt and the expected completion against the tokens per minute
+        return self.budget.counter.count_messages(request["messages"]) + self.config.llm_completion_tokens_estimate
+
+    @staticmethod
+    def _used_tokens(usage):
+        return getattr(usage, "total_tokens", None)
+
+    def _cached_response(self, request: dict):
+        if self.llm_cache is None:
+            return None
+        content = self.llm_cache.get(request)
+        if content is not None:
+            self.tracer.record_llm(None, 0.0, self.config.deployment_name, cached=True)
+        return content
+
+    def _record_response(self, request: dict, content: str, usage, seconds: float):
+        self.tracer.record_llm(usage, seconds, self.config.deployment_name)
+        if self.llm_cache is not None:
+            self.llm_cache.put(request, content, usage)
+        return content
+
+    def _completion_stream_options(self):
+        # With include_usage the last chunk of a stream carries the usage of the whole completion
+        if self.config.llm_stream_usage:
+            return {"stream": True, "stream_options": {"include_usage": True}}
+        return {"stream": True}
+
+    @staticmethod
+    def _stream_chunk(chunk, parts: list, on_token):
+        if chunk.choices:
+            token = chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                on_token(token)
+        return chunk.usage
+
+    def _stream_completion(self, request: dict, on_token):
+        parts, usage = [], None
+        try:
+            for chunk in self.client.chat.completions.create(**request, **self._completion_stream_options()):
+                usage = self._stream_chunk(chunk, parts, on_token) or usage
+        except Exception as e:
+            # Before the first token the stream can be retried, afterwards on_token would see its text twice
+            if parts:
+                raise StreamInterruptedError(f"Completion stream failed after {len(parts)} chunks: {e}") from e
+            raise
+        return "".join(parts), usage
+
+    async def _astream_completion(self, request: dict, on_token):
+        parts, usage = [], None
+        try:
+            async for chunk in await self.async_client.chat.completions.create(**request, **self._completion_stream_options()):
+                usage = self._stream_chunk(chunk, parts, on_token) or usage
+        except Exception as e:
+            if parts:
+                raise StreamInterruptedError(f"Completion stream failed after {len(parts)} chunks: {e}") from e
+            raise
+        return "".join(parts), usage
+
+    def _completion(self, request: dict):
+        response = self.client.chat.completions.create(**request)
+        return response.choices[0].message.content, response.usage
+
+    async def _acompletion(self, request: dict):
+        response = await self.async_client.chat.completions.create(**request)
+        return response.choices[0].message.content, response.usage
+
+    def call_llm(self, messages: list, temperature: float = 0.7, json_response: bool = False, on_token=None):
+        """Returns the completion of messages.
+
+        With on_token the completion is streamed and on_token is called with every chunk of
+        text as it arrives; a cached response is passed in one piece. A stream that fails
+        before its first token is retried by the rate limiter, one that fails later raises
+        StreamInterruptedError, so on_token never sees the same text twice.
+        """
+        import time
+        request = self._llm_request(messages, temperature, json_response)
+        cached = self._cached_response(request)
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+        start = time.perf_counter()
+        content, usage = self.limiter.call(
+            (lambda: self._stream_completion(request, on_token)) if on_token else (lambda: self._completion(request)),
+            tokens=self._estimated_tokens(request), usage=lambda result: self._used_tokens(result[1]))
+        return self._record_response(request, content, usage, time.perf_counter() - start)
+
+    async def acall_llm(self, messages: list, temperature: float = 0.7, json_response: bool = False, on_token=None):
+        import time
+        import asyncio
+        request = self._llm_request(messages, temperature, json_response)
+        # SQLite may wait for the write lock of another run, which must not block the event loop all runs share
+        cached = await asyncio.to_thread(self._cached_response, request) if self.llm_cache is not None else None
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+        start = time.perf_counter()
+        content, usage = await self.limiter.acall(
+            (lambda: self._astream_completion(request, on_token)) if on_token else (lambda: self._acompletion(request)),
+            tokens=self._estimated_tokens(request), usage=lambda result: self._used_tokens(result[1]))
+        seconds = time.perf_counter() - start
+        if self.llm_cache is not None:
+            return await asyncio.to_thread(self._record_response, request, content, usage, seconds)
+        return self._record_response(request, content, usage, seconds)
+
+    @staticmethod
+    def _token_writer(node: str):
+        """Returns a callback emitting the tokens of node as custom stream events, None unless the run is streamed."""
+        from langgraph.config import get_config, get_stream_writer
+        if not get_config().get("configurable", {}).get("stream_tokens"):
+            return None
+        writer = get_stream_writer()
+        return lambda token: writer({"node": node, "token": token})
+
+    def _query_writer_messages(self, state):
+        from prompts import query_writer_prompt, multi_query_writer_prompt
+        if self.config.queries_per_loop > 1:
+            query_writer_instructions_formatted = multi_query_writer_prompt.format(
+                research_topic=state.research_topic, number_of_queries=self.config.queries_per_loop)
+        else:
+            query_writer_instructions_formatted = query_writer_prompt.format(research_topic=state.research_topic)
         print("\n[generate_query] -- LLM prompt:")
         print(query_writer_instructions_formatted)
-        result = self.call_llm(
-            [
-                {"role": "system", "content": query_writer_instructions_formatted},
-                {"role": "user", "content": "Generate a query for research:"}
-            ],
-            temperature=0,
-            json_response=True
-        )
-        query = json.loads(result)
-        print(f"[generate_query] -- Generated query: {query['query']}\nAspect: {query.get('aspect', '')}\nRationale: {query.get('rationale', '')}")
-        return {"search_query": query['query']}
+        return [
+            {"role": "system", "content": query_writer_instructions_formatted},
+            {"role": "user", "content": "Generate a query for research:"}
+        ]
 
-    def mcp_research(self, state):
-        import asyncio
-        print(f"\n[mcp_research] -- Executing MCP research for query: {state.search_query}")
-        search_results = asyncio.run(self.do_mcp_research(state))
+    def _parse_query(self, state, result):
+        import json
+        response = json.loads(result)
+        # The single query prompt returns one query object, the fan-out prompt a list of them
+        queries = response.get("queries", [response])[:self.config.queries_per_loop]
+        for query in queries:
+            print(f"[generate_query] -- Generated query: {query.get('query', '')}\nAspect: {query.get('aspect', '')}\nRationale: {query.get('rationale', '')}")
+        search_queries = [query['query'] for query in queries if query.get('query')]
+        if not search_queries:
+            # An empty list of queries would end the run, search for the topic itself instead
+            print("[generate_query] -- No query generated, searching for the research topic")
+            search_queries = [state.research_topic]
+        return {"search_query": search_queries[0], "search_queries": search_queries}
+
+    def generate_query(self, state):
+        result = self.call_llm(self._query_writer_messages(state), temperature=0, json_response=True)
+        return self._parse_query(state, result)
+
+    async def agenerate_query(self, state):
+        result = await self.acall_llm(self._query_writer_messages(state), temperature=0, json_response=True)
+        return self._parse_query(state, result)
+
+    def _search_queries(self, state):
+        search_queries = state.search_queries or [state.search_query]
+        for search_query in search_queries:
+            print(f"\n[mcp_research] -- Executing MCP research for query: {search_query}")
+        return search_queries
+
+    def _research_calls(self, state, search_queries):
+        # Chunks seen in earlier loops are dropped, so ask for enough extra ones to still fill docs_per_query
+        num_docs = min(self.config.max_docs_per_query, self.config.docs_per_query + len(state.seen_chunks))
+        mmr, context_window = self.config.retrieval_mmr, self.config.context_window
+        return [lambda client, search_query=search_query: client.search_chunks(search_query, num_docs, mmr=mmr,
+                                                                               context_window=context_window)
+                for search_query in search_queries]
+
+    @staticmethod
+    def _chunk_key(chunk, chunknumber):
+        # source_path tells files with the same name in different folders apart, older points only have the filename
+        return f"{chunk.get('source_path') or chunk['filename']}#{chunknumber}"
+
+    def _research_update(self, state, search_responses):
+        seen = set(state.seen_chunks)
+        new_keys = []
+        search_results = []
+        # Information gain of the loop: share of the top results per query that are new and relevant
+        top_results = 0
+        novel_top_results = 0
+        for chunks in search_responses:
+            new_chunks = []
+            for rank, chunk in enumerate(chunks):
+                key = self._chunk_key(chunk, chunk["chunknumber"])
+                if rank < self.config.docs_per_query:
+                    top_results += 1
+                    if key not in seen and chunk.get("score", 0.0) >= self.config.novelty_min_score:
+                        novel_top_results += 1
+                if key in seen:
+                    continue
+                # A passage also covers the neighbor chunks of the hit, they count as seen as well
+                keys = [self._chunk_key(chunk, number)
+                        for number in range(chunk.get("first_chunknumber", chunk["chunknumber"]),
+                                            chunk.get("last_chunknumber", chunk["chunknumber"]) + 1)]
+                keys = [passage_key for passage_key in keys if passage_key not in seen]
+                seen.update(keys)
+                new_keys.extend(keys)
+                new_chunks.append(chunk)
+                if len(new_chunks) == self.config.docs_per_query:
+                    break
+            search_results.append("\n\n".join(chunk["content"] for chunk in new_chunks))
+        novelty = novel_top_results / top_results if top_results else 0.0
+        print(f"[mcp_research] -- {len(new_keys)} new chunks, novelty {novelty:.2f}: {new_keys}")
         print(f"[mcp_research] -- MCP research results: {search_results}")
-        return {"sources_gathered": [search_results], "research_loop_count": state.research_loop_count + 1, "mcp_research_results": [search_results]}
+        # One entry per query, merged into the earlier loops' results by the operator.add reducer
+        return {
+            "sources_gathered": new_keys,
+            "seen_chunks": new_keys,
+            "new_chunk_count": len(new_keys),
+            "novelty": novelty,
+            "research_loop_count": state.research_loop_count + 1,
+            "research_results": search_results
+        }
 
-    async def do_mcp_research(self, state):
-        client = self.MCPClient()
-        result = ""
-        try:
-            await client.connect_to_streamable_http_server(self.config.mcp_server_url)
-            result = await client.process_query(state.search_query)
-        finally:
-            await client.cleanup()
-        return result
+    def mcp_research(self, state):
+        import time
+        search_queries = self._search_queries(state)
+        start = time.perf_counter()
+        search_results = self.get_mcp_pool().call_all(self._research_calls(state, search_queries))
+        self.tracer.record_mcp(len(search_queries), time.perf_counter() - start)
+        return self._research_update(state, search_results)
 
-    def summarize_sources(self, state):
+    async def amcp_research(self, state):
+        import time
+        search_queries = self._search_queries(state)
+        start = time.perf_counter()
+        search_results = await self.get_async_mcp_pool().call_all(self._research_calls(state, search_queries))
+        self.tracer.record_mcp(len(search_queries), time.perf_counter() - start)
+        return self._research_update(state, search_results)
+
+    def _most_recent_results(self, state):
+        # The last loop added one result per search query
+        search_queries = state.search_queries or [state.search_query]
+        most_recent_results = state.research_results[-len(search_queries):]
+        if len(most_recent_results) > 1:
+            return [f"Results for query '{search_query}':\n{result}"
+                    for search_query, result in zip(search_queries, most_recent_results) if result]
+        return [result for result in most_recent_results if result]
+
+    REWRITE_TEMPLATE = (
+        "Extend the existing summary: {existing_summary}\n\n"
+        "Include new search results: {results} "
+        "That addresses the following topic: {research_topic}"
+    )
+    FIRST_SUMMARY_TEMPLATE = (
+        "Generate a summary of these search results: {results} "
+        "That addresses the following topic: {research_topic}"
+    )
+
+    def _rewrite_budget(self, state, template: str) -> int:
+        # Tokens the existing summary and the results share after the prompt and the template
         from prompts import summarizer_instructions_prompt
-        existing_summary = state.final_summary
-        most_recent_mcp_research = state.research_results[-1] if state.research_results else ""
-        if existing_summary:
-            human_message_content = (
-                f"Extend the existing summary: {existing_summary}\n\n"
-                f"Include new search results: {most_recent_mcp_research} "
-                f"That addresses the following topic: {state.research_topic}"
+        return self.budget.remaining(self.budget.summarizer_max_tokens, summarizer_instructions_prompt,
+                                     template.format(existing_summary="", results="", research_topic=state.research_topic))
+
+    def _rewrites_summary(self, state) -> bool:
+        """Whether summarize_sources rewrites the whole summary instead of adding a section.
+
+        In rewrite mode a summary that no longer fits the prompt on its own would have to be
+        truncated and the truncated rewrite would replace it, so new sections are added instead.
+        """
+        if self.config.summary_mode == "incremental":
+            return False
+        if not state.final_summary:
+            return True
+        return self.budget.counter.count(state.final_summary) < self._rewrite_budget(state, self.REWRITE_TEMPLATE)
+
+    def _summarizer_messages(self, state):
+        from prompts import summarizer_instructions_prompt, section_summarizer_prompt
+        counter = self.budget.counter
+        if not self._rewrites_summary(state):
+            # A rewrite summary that outgrew the budget is continued section by section
+            sections = state.summary_sections or ([state.final_summary] if state.final_summary else [])
+            # Only the beginning of every earlier section is sent, so the prompt does not grow with the loops
+            covered = "\n\n".join(counter.fit(sections, self.budget.summary_context_tokens)) or "Nothing yet."
+            prompt = section_summarizer_prompt
+            header = (
+                f"Report topic: {state.research_topic}\n\n"
+                f"Existing sections (beginnings):\n{covered}\n\n"
+                f"New search results:\n"
             )
+            results_budget = self.budget.remaining(self.budget.summarizer_max_tokens, prompt, header)
+            human_message_content = header + "\n\n".join(counter.fit(self._most_recent_results(state), results_budget))
         else:
-            human_message_content = (
-                f"Generate a summary of these search results: {most_recent_mcp_research} "
-                f"That addresses the following topic: {state.research_topic}"
-            )
+            prompt = summarizer_instructions_prompt
+            existing_summary = state.final_summary
+            template = self.REWRITE_TEMPLATE if existing_summary else self.FIRST_SUMMARY_TEMPLATE
+            # The existing summary is sent whole, the results share what it leaves of the budget
+            results_budget = self._rewrite_budget(state, template) - counter.count(existing_summary)
+            results = counter.fit(self._most_recent_results(state), results_budget)
+            human_message_content = template.format(existing_summary=existing_summary, results="\n\n".join(results),
+                                                    research_topic=state.research_topic)
         print("\n[summarize_sources] -- LLM prompt:")
-        print(summarizer_instructions_prompt)
+        print(prompt)
         print("[summarize_sources] -- User message:")
         print(human_message_content)
-        result = self.call_llm(
-            [
-                {"role": "system", "content": summarizer_instructions_prompt},
-                {"role": "user", "content": human_message_content}
-            ],
-            temperature=0
-        )
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": human_message_content}
+        ]
+
+    def _summary_update(self, state, result):
+        if self.config.summary_mode == "incremental":
+            section = result.strip()
+            print(f"[summarize_sources] -- New section: {section}")
+            # final_summary always holds the report so far, in case the graph is stopped early
+            return {"summary_sections": [section], "final_summary": "\n\n".join(state.summary_sections + [section])}
+        if not self._rewrites_summary(state):
+            section = result.strip()
+            print(f"[summarize_sources] -- Summary exceeds the prompt budget, new section: {section}")
+            return {"final_summary": f"{state.final_summary}\n\n{section}"}
         final_summary = result
         print(f"[summarize_sources] -- Final summary: {final_summary}")
         return {"final_summary": final_summary}
 
-    def reflect_on_summary(self, state):
-        from prompts import reflection_instructions_prompt
-        import json
-        prompt = reflection_instructions_prompt.format(research_topic=state.research_topic)
+    def summarize_sources(self, state):
+        result = self.call_llm(self._summarizer_messages(state), temperature=0,
+                               on_token=self._token_writer("summarize_sources"))
+        return self._summary_update(state, result)
+
+    async def asummarize_sources(self, state):
+        result = await self.acall_llm(self._summarizer_messages(state), temperature=0,
+                                      on_token=self._token_writer("summarize_sources"))
+        return self._summary_update(state, result)
+
+    def _reflection_messages(self, state):
+        from prompts import reflection_instructions_prompt, multi_reflection_instructions_prompt
+        if self.config.queries_per_loop > 1:
+            prompt = multi_reflection_instructions_prompt.format(
+                research_topic=state.research_topic, number_of_queries=self.config.queries_per_loop)
+        else:
+            prompt = reflection_instructions_prompt.format(research_topic=state.research_topic)
+        instruction = "Identify a knowledge gap and generate a follow-up web search query based on our existing knowledge: "
+        budget = self.budget.remaining(self.budget.reflection_max_tokens, prompt, instruction)
+        sections = state.summary_sections if self.config.summary_mode == "incremental" else [state.final_summary or ""]
+        knowledge = "\n\n".join(self.budget.counter.fit(sections, budget))
         print("\n[reflect_on_summary] -- LLM prompt:")
         print(prompt)
         print("[reflect_on_summary] -- User message:")
-        print(f"Identify a knowledge gap and generate a follow-up web search query based on our existing knowledge: {state.final_summary}")
-        result = self.call_llm(
-            [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"Identify a knowledge gap and generate a follow-up web search query based on our existing knowledge: {state.final_summary}"}
-            ],
-            temperature=0,
-            json_response=True
-        )
-        follow_up_query = json.loads(result)
-        print(f"[reflect_on_summary] -- Follow-up query: {follow_up_query.get('follow_up_query', '')}")
-        return {"search_query": follow_up_query['follow_up_query']}
+        print(f"{instruction}{knowledge}")
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": f"{instruction}{knowledge}"}
+        ]
+
+    def _parse_follow_up_query(self, state, result):
+        import json
+        response = json.loads(result)
+        # The single reflection prompt returns one knowledge gap, the fan-out prompt a list of them
+        knowledge_gaps = response.get("knowledge_gaps", [response])[:self.config.queries_per_loop]
+        for knowledge_gap in knowledge_gaps:
+            print(f"[reflect_on_summary] -- Follow-up query: {knowledge_gap.get('follow_up_query', '')}")
+        search_queries = [knowledge_gap['follow_up_query'] for knowledge_gap in knowledge_gaps
+                          if knowledge_gap.get('follow_up_query')]
+        if not search_queries:
+            # Without a follow-up query the next loop repeats the previous query, or the topic
+            search_queries = [state.search_query or state.research_topic]
+            print(f"[reflect_on_summary] -- No follow-up query generated, searching for: {search_queries[0]}")
+        return {"search_query": search_queries[0], "search_queries": search_queries}
+
+    def reflect_on_summary(self, state):
+        result = self.call_llm(self._reflection_messages(state), temperature=0, json_response=True)
+        return self._parse_follow_up_query(state, result)
+
+    async def areflect_on_summary(self, state):
+        result = await self.acall_llm(self._reflection_messages(state), temperature=0, json_response=True)
+        return self._parse_follow_up_query(state, result)
 
     def finalize_summary(self, state):
+        if not state.final_summary:
+            # The first research loop found nothing, there is no summary to report
+            state.final_summary = f"No documents were found for the research topic: {state.research_topic}"
         if self.config.print_sources_in_summary:
             all_sources = "\n".join(source for source in state.sources_gathered)
             state.final_summary = f"## Summary\n\n{state.final_summary}\n\n ### Sources:\n{all_sources}"
@@ -140,35 +752,67 @@ class ResearchAgent:
             state.final_summary = f"## Summary\n\n{state.final_summary}"
             print("\n[finalize_summary] -- Final summary (sources omitted):")
         print(state.final_summary)
+        on_token = self._token_writer("finalize_summary")
+        if on_token is not None:
+            # No LLM call here, the finished report is emitted section by section
+            sections = state.final_summary.split("\n\n")
+            for i, section in enumerate(sections):
+                on_token(section if i == len(sections) - 1 else section + "\n\n")
         return {"final_summary": state.final_summary}
 
+    def route_after_research(self, state):
+        # Nothing new came back, summarizing and reflecting again would not add anything
+        if state.new_chunk_count == 0:
+            print("[mcp_research] -- No new chunks retrieved, finalizing")
+            return "finalize_summary"
+        return "summarize_sources"
+
+    def route_after_summary(self, state):
+        # Reflection only produces the next loop's queries, skip it if there will be no next loop
+        if state.research_loop_count > self.config.max_research_loops:
+            return "finalize_summary"
+        if state.research_loop_count >= self.config.min_research_loops and state.novelty < self.config.novelty_threshold:
+            print(f"[summarize_sources] -- Novelty {state.novelty:.2f} below {self.config.novelty_threshold}, finalizing")
+            return "finalize_summary"
+        return "reflect_on_summary"
+
     def route_research(self, state, config):
         if state.research_loop_count <= self.config.max_research_loops:
             return "mcp_research"
         else:
             return "finalize_summary"
 
-    def build_graph(self):
+    def build_graph(self, use_async: bool = False):
+        """Builds the research graph.
+
+        With use_async the I/O bound nodes are coroutines using AsyncAzureOpenAI and
+        awaiting the MCP sessions directly, so the graph is meant to be driven through
+        ainvoke/astream and many runs can share one event loop. With CHECKPOINT_PATH set, the
+        state is checkpointed after every node under the thread_id of the run config, see invoke;
+        the async graph gets its checkpointer from ainvoke/astream, on the loop running it.
+        """
         from states import SummaryState, SummaryStateInput, SummaryStateOutput
         from helper import Configuration
         from langgraph.graph import START, END, StateGraph
         builder = StateGraph(SummaryState, input=SummaryStateInput, output=SummaryStateOutput, config_schema=Configuration)
-        builder.add_node("generate_query", self.generate_query)
-        builder.add_node("mcp_research", self.mcp_research)
-        builder.add_node("summarize_sources", self.summarize_sources)
-        builder.add_node("reflect_on_summary", self.reflect_on_summary)
-        builder.add_node("finalize_summary", self.finalize_summary)
+        # Every node is timed and charged with the tokens of its LLM calls, see instrumentation.py
+        trace = self.tracer.wrap_node
+        builder.add_node("generate_query", trace("generate_query", self.agenerate_query if use_async else self.generate_query))
+        builder.add_node("mcp_research", trace("mcp_research", self.amcp_research if use_async else self.mcp_research, starts_loop=True))
+        builder.add_node("summarize_sources", trace("summarize_sources", self.asummarize_sources if use_async else self.summarize_sources))
+        builder.add_node("reflect_on_summary", trace("reflect_on_summary", self.areflect_on_summary if use_async else self.reflect_on_summary))
+        builder.add_node("finalize_summary", trace("finalize_summary", self.finalize_summary))
         builder.add_edge(START, "generate_query")
         builder.add_edge("generate_query", "mcp_research")
-        builder.add_edge("mcp_research", "summarize_sources")
-        builder.add_edge("summarize_sources", "reflect_on_summary")
+        builder.add_conditional_edges("mcp_research", self.route_after_research, ["summarize_sources", "finalize_summary"])
+        builder.add_conditional_edges("summarize_sources", self.route_after_summary, ["reflect_on_summary", "finalize_summary"])
         builder.add_conditional_edges("reflect_on_summary", self.route_research)
         builder.add_edge("finalize_summary", END)
-        return builder.compile()
+        return builder.compile(checkpointer=None if use_async else self.get_checkpointer())
 
 
 if __name__ == "__main__":
-    import re
+    import sys
     from states import SummaryStateInput
     config = AgentConfig()
     agent = ResearchAgent(config)
@@ -176,7 +820,24 @@ if __name__ == "__main__":
     research_input = SummaryStateInput(
         research_topic="Benefits of Miele WTI 360"
     )
-    summary = graph.invoke(research_input)
-    cleaned_summary = re.sub(r'<think>.*?</think>', '', summary['final_summary'], flags=re.DOTALL)
-    cleaned_summary = re.sub(r'\n{3,}', '\n\n', cleaned_summary)
-    print(cleaned_summary)
\ No newline at end of file
+    finalized = False
+    try:
+        # With CHECKPOINT_PATH set, running the script again resumes an interrupted run of the topic
+        for event in agent.stream(graph, research_input, thread_id=research_input["research_topic"]):
+            if event["type"] == "node_start":
+                print(f"\n>>> {event['node']}", flush=True)
+            elif event["type"] == "token":
+                finalized = finalized or event["node"] == "finalize_summary"
+                sys.stdout.write(event["text"])
+                sys.stdout.flush()
+            elif event["type"] == "node_end" and event["error"]:
+                print(f"\n<<< {event['node']} failed: {event['error']}", flush=True)
+            elif event["type"] == "result" and not finalized:
+                # A run that finished before is read from its checkpoint without streaming any nodes
+                print(event["final_summary"])
+    finally:
+        agent.close()
+    print()
+    for node, totals in agent.tracer.summary().items():
+        print(f"[{node}] {totals['calls']} calls, {totals['seconds']:.2f}s, {totals['prompt_tokens']} prompt / "
+              f"{totals['completion_tokens']} completion tokens, cost {totals['cost']:.4f}")
\ No newline at end of file
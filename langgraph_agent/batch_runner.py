@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+
+from agent import AgentConfig, ResearchAgent
+from helper import strip_thinking_tokens
+
+
+def read_topics(input_path: str, id_field: str, topic_field: str):
+    """Reads the research topics from a JSONL file, the topic doubles as ID if there is none."""
+    with open(input_path, 'r', encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if topic_field not in record:
+                raise ValueError(f"Line {line_number} of {input_path} has no '{topic_field}' field")
+            yield {"id": str(record.get(id_field, record[topic_field])), "research_topic": record[topic_field]}
+
+
+def read_completed_ids(output_path: str) -> set:
+    """Returns the IDs of the topics a previous run already finished successfully."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut off by a crash, the topic is simply run again
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["id"])
+    return completed
+
+
+def percentile(values: list, p: float) -> float:
+    """Returns the p-th percentile of values using linear interpolation."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+async def run_batch(agent: ResearchAgent, topics: list, output_path: str, concurrency: int,
+                    restart: bool = False) -> list:
+    """Runs the async research graph for all topics with at most concurrency runs in flight.
+
+    Every finished topic is appended to output_path right away, so a crash loses only the
+    runs that were in flight. With restart, checkpoints of earlier runs are discarded instead
+    of resumed. Returns the latencies of the successful runs in seconds.
+    """
+    # Every run in flight makes up to queries_per_loop MCP calls at once, a smaller pool would serialize them
+    config = agent.config
+    config.mcp_pool_size = max(config.mcp_pool_size, max(1, concurrency) * config.queries_per_loop)
+    graph = agent.build_graph(use_async=True)
+    pending = iter(topics)
+    latencies = []
+    failed = 0
+
+    with open(output_path, 'a', encoding="utf-8") as out:
+        async def worker():
+            nonlocal failed
+            for topic in pending:
+                start = time.perf_counter()
+                record = {"id": topic["id"], "research_topic": topic["research_topic"]}
+                try:
+                    # The topic ID is the checkpoint thread, a topic interrupted in an earlier batch resumes
+                    summary = await agent.ainvoke(graph, {"research_topic": topic["research_topic"]},
+                                                  thread_id=topic["id"], restart=restart)
+                    record["status"] = "ok"
+                    record["final_summary"] = strip_thinking_tokens(summary["final_summary"])
+                except Exception as e:
+                    record["status"] = "error"
+                    record["error"] = f"{type(e).__name__}: {e}"
+                    failed += 1
+                latency = time.perf_counter() - start
+                record["latency_seconds"] = round(latency, 3)
+                if record["status"] == "ok":
+                    latencies.append(latency)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                print(f"[{record['status']}] {topic['id']} ({latency:.1f}s), "
+                      f"{len(latencies) + failed}/{len(topics)} done", file=sys.stderr)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            await agent.aclose()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the research agent for every topic of a JSONL file.")
+    parser.add_argument("input", help="JSONL file with one research topic per line")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of research runs in flight (default: 4)")
+    parser.add_argument("--id-field", default="id", help="Field holding the topic ID (default: id)")
+    parser.add_argument("--topic-field", default="research_topic", help="Field holding the topic (default: research_topic)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the node output on stdout")
+    parser.add_argument("--restart", action="store_true",
+                        help="Run every topic again from scratch, even if the output file or a checkpoint has it")
+    args = parser.parse_args()
+
+    topics = list(read_topics(args.input, args.id_field, args.topic_field))
+    completed = set() if args.restart else read_completed_ids(args.output)
+    remaining = [topic for topic in topics if topic["id"] not in completed]
+    print(f"{len(topics)} topics, {len(topics) - len(remaining)} already completed, {len(remaining)} to run", file=sys.stderr)
+
+    agent = ResearchAgent(AgentConfig())
+    start = time.perf_counter()
+    # The nodes print their prompts and results, which is unreadable with concurrent runs
+    with open(os.devnull, 'w') as devnull, (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)):
+        latencies = asyncio.run(run_batch(agent, remaining, args.output, args.concurrency, args.restart))
+    elapsed = time.perf_counter() - start
+
+    print(f"Finished {len(latencies)}/{len(remaining)} topics in {elapsed:.1f}s "
+          f"({60 * len(latencies) / elapsed if elapsed else 0.0:.2f} topics/min)", file=sys.stderr)
+    print(f"Latency p50 {percentile(latencies, 50):.1f}s, p90 {percentile(latencies, 90):.1f}s, "
+          f"p99 {percentile(latencies, 99):.1f}s, max {max(latencies, default=0.0):.1f}s", file=sys.stderr)
+    if agent.llm_cache is not None:
+        print(f"LLM cache: {agent.llm_cache.stats()}", file=sys.stderr)
+    print(f"LLM rate limiter: {agent.limiter.stats()}", file=sys.stderr)
+    for node, totals in agent.tracer.summary().items():
+        print(f"[{node}] {totals['calls']} calls, {totals['seconds']:.1f}s, {totals['prompt_tokens']} prompt / "
+              f"{totals['completion_tokens']} completion tokens, cost {totals['cost']:.4f}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from typing import Any, Dict, List, Union
 import os
+import re
 from enum import Enum
 from pydantic import BaseModel, Field
 from typing import Any, Optional, Literal
@@ -70,6 +71,74 @@ def deduplicate_and_format_sources(
                 
     return formatted_text.strip()
 
+def strip_thinking_tokens(text: str) -> str:
+    """
+    Remove <think>...</think> blocks of reasoning models from a model response.
+
+    Args:
+        text (str): Model response
+
+    Returns:
+        str: Response without thinking blocks and without runs of more than two newlines
+    """
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    return re.sub(r'\n{3,}', '\n\n', text)
+
+class ThinkingFilter:
+    """
+    Incremental strip_thinking_tokens for a streamed response.
+
+    feed() returns the part of a chunk outside of <think> blocks. A tag split across
+    chunks is held back until it is complete, so nothing of a thinking block leaks out;
+    an unclosed block swallows the rest of the response.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.thinking = False
+        self.newlines = 0
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        output = []
+        while True:
+            tag = "</think>" if self.thinking else "<think>"
+            index = self.buffer.find(tag)
+            if index < 0:
+                break
+            if not self.thinking:
+                output.append(self.buffer[:index])
+            self.buffer = self.buffer[index + len(tag):]
+            self.thinking = not self.thinking
+        # Keep the end of the buffer that may be the start of the next tag
+        keep = next((size for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1)
+                     if tag.startswith(self.buffer[-size:])), 0)
+        if not self.thinking:
+            output.append(self.buffer[:len(self.buffer) - keep])
+        self.buffer = self.buffer[len(self.buffer) - keep:]
+        return self._collapse_newlines("".join(output))
+
+    def flush(self) -> str:
+        """Returns the held back text at the end of the response and resets the filter."""
+        text = "" if self.thinking else self.buffer
+        self.buffer, self.thinking = "", False
+        text = self._collapse_newlines(text)
+        self.newlines = 0
+        return text
+
+    def _collapse_newlines(self, text: str) -> str:
+        # Runs of more than two newlines may span chunks, the run length is carried over
+        output = []
+        for char in text:
+            if char == "\n":
+                self.newlines += 1
+                if self.newlines > 2:
+                    continue
+            else:
+                self.newlines = 0
+            output.append(char)
+        return "".join(output)
+
 def format_sources(search_results: Dict[str, Any]) -> str:
     """
     Format search results into a bullet-point list of sources with URLs.
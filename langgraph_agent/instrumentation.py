@@ -0,0 +1,197 @@
+import contextvars
+import inspect
+import json
+import sys
+import threading
+import time
+
+# The node span the current LLM and MCP calls are attributed to
+_current_span = contextvars.ContextVar("current_node_span", default=None)
+
+
+class _NodeSpan:
+    def __init__(self, run_id: str, node: str, loop: int):
+        self.run_id = run_id
+        self.node = node
+        self.loop = loop
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.mcp_calls = 0
+        self.mcp_seconds = 0.0
+
+
+class Tracer:
+    """Records wall time, token usage and cost of the graph's nodes.
+
+    Every finished node, LLM call and MCP call is appended as one JSON line to trace_path
+    (if set), the per-node totals of the process are kept in memory for summary().
+    """
+
+    def __init__(self, trace_path: str = None, prompt_price_per_1k: float = 0.0, completion_price_per_1k: float = 0.0):
+        self.trace_path = trace_path
+        self.prompt_price_per_1k = prompt_price_per_1k
+        self.completion_price_per_1k = completion_price_per_1k
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def _write(self, record: dict):
+        if not self.trace_path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.trace_path, 'a', encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def wrap_node(self, name: str, fn, starts_loop: bool = False):
+        """Wraps a graph node so its wall time and the LLM and MCP calls it makes are recorded.
+
+        The run is identified by the thread_id of the graph config, falling back to the research
+        topic. Nodes are attributed to the research loop they belong to; starts_loop marks the
+        node that opens a new loop (mcp_research), as it runs before research_loop_count is increased.
+        """
+        def start(state, config):
+            configurable = (config or {}).get("configurable", {})
+            run_id = str(configurable.get("thread_id") or state.research_topic)
+            loop = state.research_loop_count + (1 if starts_loop else 0)
+            span = _NodeSpan(run_id, name, loop)
+            return span, _current_span.set(span), time.perf_counter()
+
+        def finish(span, token, started, error=None):
+            elapsed = time.perf_counter() - started
+            _current_span.reset(token)
+            record = {
+                "type": "node",
+                "timestamp": time.time(),
+                "run_id": span.run_id,
+                "node": span.node,
+                "loop": span.loop,
+                "duration_seconds": round(elapsed, 6),
+                "llm_calls": span.llm_calls,
+                "llm_seconds": round(span.llm_seconds, 6),
+                "prompt_tokens": span.prompt_tokens,
+                "completion_tokens": span.completion_tokens,
+                "cost": round(span.cost, 6),
+                "mcp_calls": span.mcp_calls,
+                "mcp_seconds": round(span.mcp_seconds, 6),
+            }
+            if error is not None:
+                record["error"] = f"{type(error).__name__}: {error}"
+            with self._lock:
+                totals = self._totals.setdefault(span.node, {
+                    "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+                totals["calls"] += 1
+                totals["seconds"] += elapsed
+                totals["prompt_tokens"] += span.prompt_tokens
+                totals["completion_tokens"] += span.completion_tokens
+                totals["cost"] += span.cost
+            self._write(record)
+
+        if inspect.iscoroutinefunction(fn):
+            # No functools.wraps: LangGraph must see the config parameter, not the wrapped signature
+            async def async_node(state, config):
+                span, token, started = start(state, config)
+                try:
+                    result = await fn(state)
+                except Exception as e:
+                    finish(span, token, started, e)
+                    raise
+                finish(span, token, started)
+                return result
+            return async_node
+
+        def node(state, config):
+            span, token, started = start(state, config)
+            try:
+                result = fn(state)
+            except Exception as e:
+                finish(span, token, started, e)
+                raise
+            finish(span, token, started)
+            return result
+        return node
+
+    def record_llm(self, usage, seconds: float, model: str = None, cached: bool = False):
+        """Records one chat completion; usage is the response's usage object, which may be missing.
+
+        Responses served from the LLM cache are recorded with cached=True and cost nothing.
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = (prompt_tokens * self.prompt_price_per_1k + completion_tokens * self.completion_price_per_1k) / 1000
+        span = _current_span.get()
+        if span is not None:
+            span.llm_calls += 1
+            span.llm_seconds += seconds
+            span.prompt_tokens += prompt_tokens
+            span.completion_tokens += completion_tokens
+            span.cost += cost
+        self._write({
+            "type": "llm",
+            "timestamp": time.time(),
+            "run_id": span.run_id if span else None,
+            "node": span.node if span else None,
+            "model": model,
+            "duration_seconds": round(seconds, 6),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": round(cost, 6),
+            "cached": cached,
+        })
+
+    def record_mcp(self, calls: int, seconds: float):
+        """Records the wall time of MCP tool calls made by the current node."""
+        span = _current_span.get()
+        if span is not None:
+            span.mcp_calls += calls
+            span.mcp_seconds += seconds
+        self._write({
+            "type": "mcp",
+            "timestamp": time.time(),
+            "run_id": span.run_id if span else None,
+            "node": span.node if span else None,
+            "calls": calls,
+            "duration_seconds": round(seconds, 6),
+        })
+
+    def summary(self) -> dict:
+        """Returns calls, wall time, tokens and cost per node since the tracer was created."""
+        with self._lock:
+            return {node: dict(totals) for node, totals in self._totals.items()}
+
+
+def summarize_trace(trace_path: str) -> dict:
+    """Aggregates the node records of a trace file per run and research loop."""
+    runs = {}
+    with open(trace_path, 'r', encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") != "node":
+                continue
+            run = runs.setdefault(record["run_id"], {"seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                      "cost": 0.0, "loops": {}})
+            loop = run["loops"].setdefault(record["loop"], {"seconds": 0.0, "llm_seconds": 0.0, "mcp_seconds": 0.0,
+                                                             "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            for totals in (run, loop):
+                totals["seconds"] += record["duration_seconds"]
+                totals["prompt_tokens"] += record["prompt_tokens"]
+                totals["completion_tokens"] += record["completion_tokens"]
+                totals["cost"] += record["cost"]
+            loop["llm_seconds"] += record["llm_seconds"]
+            loop["mcp_seconds"] += record["mcp_seconds"]
+    return runs
+
+
+if __name__ == "__main__":
+    # Prints the per-loop breakdown of every run in a trace file written with TRACE_PATH
+    if len(sys.argv) != 2:
+        print("Usage: python instrumentation.py <trace.jsonl>")
+        sys.exit(1)
+    for run_id, run in summarize_trace(sys.argv[1]).items():
+        print(f"{run_id}: {run['seconds']:.2f}s, {run['prompt_tokens']} prompt / "
+              f"{run['completion_tokens']} completion tokens, cost {run['cost']:.4f}")
+        for loop, totals in sorted(run["loops"].items()):
+            print(f"  loop {loop}: {totals['seconds']:.2f}s (LLM {totals['llm_seconds']:.2f}s, "
+                  f"MCP {totals['mcp_seconds']:.2f}s), {totals['prompt_tokens']} prompt / "
+                  f"{totals['completion_tokens']} completion tokens, cost {totals['cost']:.4f}")
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class LLMCacheMissError(Exception):
+    """Raised in replay mode for a request that is not in the cache."""
+
+
+class LLMResponseCache:
+    """Content-addressed SQLite cache for chat completion responses.
+
+    Entries are keyed by a hash of the deployment, the messages, the temperature and the
+    response format. When the stored responses exceed max_bytes, the least recently used ones
+    are evicted; the total size is kept in a meta row, so a store does not scan the table.
+    In "replay" mode every request must be answered from the cache, a miss raises
+    LLMCacheMissError instead of calling the model, so regression runs are reproducible.
+    """
+
+    MODES = ("readwrite", "replay")
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, mode: str = "readwrite"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {self.MODES}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets concurrent batch runs share the cache file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, prompt_tokens INTEGER, completion_tokens INTEGER, "
+            "size INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_responses_last_used ON llm_responses (last_used)")
+        # Single row with the total size of the responses, counted once for caches created before it existed
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache_meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER NOT NULL)"
+        )
+        self._db.execute("INSERT OR IGNORE INTO llm_cache_meta SELECT 0, COALESCE(SUM(size), 0) FROM llm_responses")
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(request: dict) -> str:
+        """Hashes the fields of a chat completion request that determine its response."""
+        material = {
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "temperature": request.get("temperature"),
+            "response_format": request.get("response_format"),
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, request: dict):
+        """Returns the cached response content or None; raises LLMCacheMissError on a miss in replay mode."""
+        key = self.key(request)
+        with self._lock:
+            row = self._db.execute("SELECT content FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise LLMCacheMissError(f"No cached response for request {key[:12]} in replay mode")
+                return None
+            self._db.execute("UPDATE llm_responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, request: dict, content: str, usage=None):
+        """Stores a response and evicts the least recently used entries above max_bytes."""
+        if content is None:
+            return
+        now = time.time()
+        key = self.key(request)
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            # The write lock is taken up front, so other processes cannot change the total in between
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = self._db.execute("SELECT size FROM llm_responses WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, content, getattr(usage, "prompt_tokens", None),
+                     getattr(usage, "completion_tokens", None), size, now, now)
+                )
+                total = self._add_size(size - (replaced[0] if replaced else 0))
+                while total > self.max_bytes:
+                    # Oldest entries first, in pages over the last_used index
+                    rows = self._db.execute("SELECT key, size FROM llm_responses ORDER BY last_used LIMIT 64").fetchall()
+                    evict, evicted_size = [], 0
+                    for evict_key, entry_size in rows:
+                        if total - evicted_size <= self.max_bytes:
+                            break
+                        evict.append((evict_key,))
+                        evicted_size += entry_size
+                    if not evict:
+                        break
+                    self._db.executemany("DELETE FROM llm_responses WHERE key = ?", evict)
+                    total = self._add_size(-evicted_size)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def _add_size(self, delta: int) -> int:
+        self._db.execute("UPDATE llm_cache_meta SET total_size = total_size + ? WHERE id = 0", (delta,))
+        return self._db.execute("SELECT total_size FROM llm_cache_meta WHERE id = 0").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            size = self._db.execute("SELECT total_size FROM llm_cache_meta WHERE id = 0").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,13 +1,34 @@
 import asyncio
+import json
 from mcp import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
 from typing import Optional
 from contextlib import AsyncExitStack
 
+class MCPToolError(Exception):
+    """Raised when the server answers a tool call with an error result, the session itself is fine."""
+
+
+def chunks_from_result(result) -> list:
+    """Turns a get_rag_data_with_context result into a list of chunk dicts.
+
+    The server returns one JSON object with a list per field, older servers returned one
+    JSON text item per chunk.
+    """
+    if len(result.content) == 1:
+        data = json.loads(result.content[0].text)
+        if isinstance(data, dict) and isinstance(data.get("score"), list):
+            names = list(data)
+            return [dict(zip(names, row)) for row in zip(*data.values())]
+    return [json.loads(item.text) for item in result.content]
+
+
 class MCPClient:
     def __init__(self):
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
+        self._stream_context = None
+        self._session_context = None
 
     async def connect_to_streamable_http_server(
         self, server_url: str, headers: Optional[dict] = None
@@ -32,14 +53,24 @@ class MCPClient:
                 return result_text
             else:
                 print(f"Error processing query: {query}\nError: {result.error if hasattr(result, 'error') else result}")
-                raise Exception(f"Error processing query: {query}")
+                raise MCPToolError(f"Error processing query: {query}")
         except Exception as e:
             import traceback
             print(f"Exception in process_query: {e}\nTraceback:\n{traceback.format_exc()}")
             raise
         
-    async def process_query_with_context(self, query: str, num_docs: int = 5):
+    async def process_query_with_context(self, query: str, num_docs: int = 5, fields: Optional[list] = None,
+                                         max_content_chars: Optional[int] = None, min_score: Optional[float] = None,
+                                         mmr: bool = False, context_window: int = 0):
         tool_args = {"query": query, "num_docs": num_docs}
+        if mmr:
+            tool_args["mmr"] = True
+        if context_window:
+            tool_args["context_window"] = context_window
+        # Only send the options that are set, so older servers without them still accept the call
+        for name, value in (("fields", fields), ("max_content_chars", max_content_chars), ("min_score", min_score)):
+            if value is not None:
+                tool_args[name] = value
         tool_name = "get_rag_data_with_context"  
         result = await self.session.call_tool(
             tool_name, tool_args
@@ -47,11 +78,34 @@ class MCPClient:
         if not result.isError:
             return result
         else:
-            raise Exception(f"Error processing query: {query}")
+            raise MCPToolError(f"Error processing query: {query}")
+
+    async def search_chunks(self, query: str, num_docs: int = 5, fields: Optional[list] = None,
+                            max_content_chars: Optional[int] = None, min_score: Optional[float] = None,
+                            mmr: bool = False, context_window: int = 0):
+        """Runs get_rag_data_with_context, returns a list of chunk dicts with score and the selected fields."""
+        result = await self.process_query_with_context(query, num_docs, fields, max_content_chars, min_score, mmr,
+                                                       context_window)
+        return chunks_from_result(result)
+
+    async def process_query_batch(self, queries: list, num_docs: int = 5, deduplicate: bool = False):
+        """Runs several queries with one tool call, returns a list of {"query", "chunks"} dicts."""
+        tool_args = {"queries": queries, "num_docs": num_docs, "deduplicate": deduplicate}
+        tool_name = "get_rag_data_batch"
+        result = await self.session.call_tool(
+            tool_name, tool_args
+        )
+        if not result.isError:
+            return json.loads(result.content[0].text)["results"]
+        else:
+            raise MCPToolError(f"Error processing queries: {queries}")
 
     async def cleanup(self):
         """Cleanup resources."""
         if self._session_context:
             await self._session_context.__aexit__(None, None, None)
+            self._session_context = None
         if self._stream_context:  
             await self._stream_context.__aexit__(None, None, None)
+            self._stream_context = None
+        self.session = None
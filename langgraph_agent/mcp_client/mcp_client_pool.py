@@ -0,0 +1,148 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+import anyio
+import httpx
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+from .mcp_client import MCPClient
+
+T = TypeVar("T")
+
+
+def is_transport_error(error: BaseException) -> bool:
+    """Whether error means the connection broke, as opposed to an error result of the tool."""
+    if isinstance(error, McpError):
+        # The session reports a closed stream and a request timeout as MCP errors
+        return error.error.code in (CONNECTION_CLOSED, httpx.codes.REQUEST_TIMEOUT)
+    return isinstance(error, (httpx.TransportError, anyio.ClosedResourceError, anyio.BrokenResourceError,
+                              anyio.EndOfStream, ConnectionError))
+
+
+class _PooledSession:
+    """One MCP connection that stays open until it is closed or breaks.
+
+    The streamable HTTP transport and the client session are async context managers
+    that have to be entered and exited by the same task. Each connection is therefore
+    held open by its own task, which waits for the stop signal and then cleans up.
+    """
+
+    def __init__(self, server_url: str, headers: Optional[dict]):
+        self.server_url = server_url
+        self.headers = headers
+        self.client: Optional[MCPClient] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def connect(self):
+        ready = asyncio.get_running_loop().create_future()
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._hold(ready))
+        self.client = await ready
+
+    async def _hold(self, ready: asyncio.Future):
+        client = MCPClient()
+        try:
+            await client.connect_to_streamable_http_server(self.server_url, self.headers)
+            ready.set_result(client)
+            await self._stop.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            try:
+                await client.cleanup()
+            except BaseException as e:
+                print(f"Error while closing MCP session: {e}")
+
+    async def disconnect(self):
+        if self._task is not None:
+            self._stop.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.client = None
+
+
+class MCPClientPool:
+    """Pool of long-lived MCP sessions that are reused across calls.
+
+    Sessions are opened lazily on first use, reconnected when a call fails because the
+    connection broke and closed by aclose(). The pool is bound to the event loop it is
+    first used on and has to be closed before that loop ends.
+    """
+
+    def __init__(self, server_url: str, size: int = 1, headers: Optional[dict] = None):
+        self.server_url = server_url
+        self.size = max(1, size)
+        self._sessions = [_PooledSession(server_url, headers) for _ in range(self.size)]
+        self._available: Optional[asyncio.Queue] = None
+        self.reconnects = 0
+
+    def _queue(self) -> asyncio.Queue:
+        if self._available is None:
+            self._available = asyncio.Queue()
+            for session in self._sessions:
+                self._available.put_nowait(session)
+        return self._available
+
+    async def call(self, fn: Callable[[MCPClient], Awaitable[T]]) -> T:
+        """Runs fn with a connected MCPClient, retrying once on a fresh connection if the connection broke."""
+        available = self._queue()
+        session = await available.get()
+        try:
+            if not session.connected:
+                await session.connect()
+            try:
+                return await fn(session.client)
+            except Exception as e:
+                # Tool errors and errors of fn itself would only fail again on a new connection
+                if not is_transport_error(e):
+                    raise
+                print(f"MCP call failed, reconnecting to {self.server_url}: {e}")
+                self.reconnects += 1
+                await session.disconnect()
+                await session.connect()
+                return await fn(session.client)
+        finally:
+            available.put_nowait(session)
+
+    async def call_all(self, fns: List[Callable[[MCPClient], Awaitable[T]]]) -> List[T]:
+        """Runs all fns concurrently, each with its own pooled MCPClient."""
+        return list(await asyncio.gather(*(self.call(fn) for fn in fns)))
+
+    async def aclose(self):
+        """Closes all open sessions."""
+        await asyncio.gather(*(session.disconnect() for session in self._sessions), return_exceptions=True)
+
+
+class BlockingMCPClientPool:
+    """Runs an MCPClientPool on a dedicated event loop thread for synchronous callers."""
+
+    def __init__(self, server_url: str, size: int = 1, headers: Optional[dict] = None):
+        self.pool = MCPClientPool(server_url, size=size, headers=headers)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="mcp-client-pool", daemon=True)
+        self._thread.start()
+
+    def call(self, fn: Callable[[MCPClient], Awaitable[T]]) -> T:
+        """Runs fn with a pooled MCPClient and blocks until it has finished."""
+        return asyncio.run_coroutine_threadsafe(self.pool.call(fn), self._loop).result()
+
+    def call_all(self, fns: List[Callable[[MCPClient], Awaitable[T]]]) -> List[T]:
+        """Runs all fns concurrently and blocks until all of them have finished."""
+        return asyncio.run_coroutine_threadsafe(self.pool.call_all(fns), self._loop).result()
+
+    def close(self):
+        """Closes all sessions and stops the event loop thread."""
+        if not self._thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self.pool.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
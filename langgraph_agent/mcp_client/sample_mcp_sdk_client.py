@@ -1,6 +1,5 @@
 import asyncio
-from mcp_client import MCPClient
-import json
+from mcp_client import MCPClient, chunks_from_result
 
 url = "http://localhost:8000/mcp/stream"
 sample_query = "Wie lege ich Wäsche nach?"
@@ -13,8 +12,7 @@ async def main():
         print(f"Result from simple query: {result_simple}")
         result_with_context = await client.process_query_with_context(sample_query)
         print(f"Result from query with context:")
-        for chunk in result_with_context.content:
-            chunk_json = json.loads(chunk.text)
+        for chunk_json in chunks_from_result(result_with_context):
             print(f"Chunk content: {chunk_json['content'][:100]}")
             print(f"Filename: {chunk_json['filename']}")
             print(f"Chunk number: {chunk_json['chunknumber']}")
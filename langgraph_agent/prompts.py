@@ -14,6 +14,26 @@ Return your query as a JSON object:
 """
 # rationale - why this query is important. incourages model to think about generation of a query itself
 
+# multi query writer prompt - fan-out of several queries per research loop
+multi_query_writer_prompt="""Your goal is to generate {number_of_queries} targeted research queries.
+The queries will gather information related to a specific topic.
+Every query must cover a different aspect of the topic.
+
+Topic:
+{research_topic}
+
+Return your queries as a JSON object:
+{{
+    "queries": [
+        {{
+            "query": "string",
+            "aspect": "string",
+            "rationale": "string"
+        }}
+    ]
+}}
+"""
+
 # summarizer instructions prompt - 1st summarisation
 summarizer_instructions_prompt="""Your goal is to generate a high-quality summary of the web search results.
 
@@ -38,6 +58,22 @@ In both cases:
 - DO NOT add a References or Works Cited section.
 """
 
+# section summarizer prompt - incremental summarisation, one new section per research loop
+section_summarizer_prompt="""Your goal is to write one new section of a report from the search results.
+
+The report is built section by section. You see the beginning of the sections written so far
+and the new search results. Write only the new section:
+1. Start with a short markdown heading (### ...) naming what the section covers
+2. Include only information from the new search results that the existing sections do not cover yet
+3. Highlight the most relevant facts for the report topic
+4. Keep it concise and factual, with consistent technical depth
+
+- DO NOT repeat information from the existing sections
+- DO NOT use phrases like "based on the new results" or "according to additional sources"
+- DO NOT add a preamble like "Here is the new section ..." Just directly output the section.
+- DO NOT add a References or Works Cited section.
+"""
+
 # reflection prompt - for agents internal thinking
 reflection_instructions_prompt = """You are an expert research assistant analyzing a summary about {research_topic}.
 
@@ -53,3 +89,23 @@ Return your analysis as a JSON object:
     "knowledge_gap": "string",
     "follow_up_query": "string"
 }}"""
+
+# multi reflection prompt - one follow-up query per knowledge gap
+multi_reflection_instructions_prompt = """You are an expert research assistant analyzing a summary about {research_topic}.
+
+Your tasks:
+1. Identify up to {number_of_queries} distinct knowledge gaps or areas that need deeper exploration
+2. Generate one follow-up question per knowledge gap that would help expand your understanding
+3. Focus on technical details, implementation specifics, or emerging trends that weren't fully covered
+
+Ensure every follow-up question is self-contained and includes necessary context for web search.
+
+Return your analysis as a JSON object:
+{{
+    "knowledge_gaps": [
+        {{
+            "knowledge_gap": "string",
+            "follow_up_query": "string"
+        }}
+    ]
+}}"""
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+# HTTP statuses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_minute, holding at most one minute of quota.
+
+    reserve() takes the tokens right away and returns how long the caller has to wait before
+    using them, so the bucket can go into debt and concurrent callers queue up in order.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A single request larger than the bucket waits for a full bucket instead of forever
+        self.tokens -= min(amount, self.capacity)
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self, amount: float):
+        """Returns tokens that were reserved but not used, or takes more with a negative amount."""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def retry_after_seconds(error):
+    """Reads the Retry-After delay from the response of an API error, None if there is none."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                # An HTTP date instead of seconds, fall back to the backoff
+                return None
+    return None
+
+
+def is_retryable(error) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # Connection errors and timeouts of the openai and httpx clients carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout",
+                                    "ConnectTimeout", "TimeoutError")
+
+
+class RateLimiter:
+    """Client side limiter for one Azure deployment, shared by all calls of a process.
+
+    Every call reserves one request from the requests-per-minute bucket and its estimated
+    tokens from the tokens-per-minute bucket; the estimate is corrected with the actual usage
+    afterwards. The number of calls in flight follows an AIMD controller: it is halved on
+    every throttled response and grows by one per window of successful calls, up to
+    max_concurrency. Throttled and transient failures are retried after the Retry-After delay
+    of the response or a jittered exponential backoff, during which all calls of the limiter
+    pause, so the deployment can run at its quota without failing the callers.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrency: int = 16, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def _try_start(self, tokens: float):
+        """Returns 0 once the call may start, otherwise the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._in_flight >= int(self.concurrency_limit):
+                # Woken up by polling, calls take long compared to this interval
+                return 0.05
+            self._in_flight += 1
+            delay = 0.0
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1))
+            if self.tokens is not None and tokens:
+                delay = max(delay, self.tokens.reserve(tokens))
+            return -delay if delay else 0
+
+    def _succeeded(self, tokens: float, used_tokens):
+        with self._lock:
+            self._in_flight -= 1
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.refund(tokens - used_tokens)
+            # Additive increase: one more slot per concurrency_limit successful calls
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def _failed(self, tokens: float, error, last_attempt: bool) -> bool:
+        """Releases the slot of a failed call and returns True if it should be retried."""
+        with self._lock:
+            self._in_flight -= 1
+            retryable = isinstance(error, Exception) and is_retryable(error)
+            if retryable and self.tokens is not None:
+                # Throttled, timed out and failed requests produced no usage, a retry reserves its tokens again
+                self.tokens.refund(tokens)
+            if getattr(error, "status_code", None) == 429:
+                self.throttled += 1
+                # Multiplicative decrease on every throttled call
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            retry = retryable and not last_attempt
+            if not retry:
+                self.failures += 1
+            return retry
+
+    def _backoff(self, error, attempt: int) -> float:
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full jitter keeps the retries of concurrent callers apart
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._lock:
+            self.retries += 1
+            if getattr(error, "status_code", None) == 429:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, fn, tokens: float = 0, usage=None):
+        """Runs fn() within the limits, retrying throttled and transient failures.
+
+        tokens is the estimated token count of the request, usage maps the result to the
+        tokens actually used.
+        """
+        for attempt in range(self.max_retries + 1):
+            while True:
+                delay = self._try_start(tokens)
+                if delay <= 0:
+                    break
+                self._wait(delay)
+            try:
+                if delay < 0:
+                    # The slot is taken, the buckets asked to wait before sending
+                    self._wait(-delay)
+                self._count_call()
+                result = fn()
+            except BaseException as e:
+                if not self._failed(tokens, e, attempt == self.max_retries):
+                    raise
+                self._wait(self._backoff(e, attempt))
+                continue
+            self._succeeded(tokens, usage(result) if usage else None)
+            return result
+
+    async def acall(self, fn, tokens: float = 0, usage=None):
+        """Async call, fn returns an awaitable."""
+        for attempt in range(self.max_retries + 1):
+            while True:
+                delay = self._try_start(tokens)
+                if delay <= 0:
+                    break
+                await self._await(delay)
+            try:
+                if delay < 0:
+                    await self._await(-delay)
+                self._count_call()
+                result = await fn()
+            except BaseException as e:
+                # Also releases the slot of a cancelled call
+                if not self._failed(tokens, e, attempt == self.max_retries):
+                    raise
+                await self._await(self._backoff(e, attempt))
+                continue
+            self._succeeded(tokens, usage(result) if usage else None)
+            return result
+
+    def _count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def _wait(self, seconds: float):
+        with self._lock:
+            self.wait_seconds += seconds
+        time.sleep(seconds)
+
+    async def _await(self, seconds: float):
+        with self._lock:
+            self.wait_seconds += seconds
+        await asyncio.sleep(seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "failures": self.failures,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "in_flight": self._in_flight,
+                "concurrency_limit": int(self.concurrency_limit),
+            }
+
+
+def create_rate_limiter(prefix: str) -> RateLimiter:
+    """Creates the limiter of a deployment from the environment variables starting with prefix.
+
+    <prefix>_REQUESTS_PER_MINUTE and <prefix>_TOKENS_PER_MINUTE are the quota of the deployment
+    (unlimited if empty), <prefix>_MAX_CONCURRENCY caps the calls in flight and
+    <prefix>_MAX_RETRIES the retries of a throttled or failed call.
+    """
+    def number(name: str, default=None):
+        value = os.environ.get(f"{prefix}_{name}")
+        return float(value) if value else default
+
+    return RateLimiter(
+        prefix.lower(),
+        requests_per_minute=number("REQUESTS_PER_MINUTE"),
+        tokens_per_minute=number("TOKENS_PER_MINUTE"),
+        max_concurrency=int(number("MAX_CONCURRENCY", 16)),
+        max_retries=int(number("MAX_RETRIES", 6))
+    )
@@ -8,9 +8,14 @@ class SummaryState:
     """Summary state data class."""
     research_topic: str = field(default=None) # report topic
     search_query: str = field(default=None) # search query
+    search_queries: list = field(default_factory=list) # all search queries of the current loop
     research_results : Annotated[list, operator.add] = field(default_factory=list) # web research results
     sources_gathered : Annotated[list, operator.add] = field(default_factory=list) # sources gathered (urls)
+    seen_chunks : Annotated[list, operator.add] = field(default_factory=list) # keys (filename#chunknumber) of all chunks retrieved so far
+    new_chunk_count : int = field(default=0) # number of unseen chunks the last research loop retrieved
+    novelty : float = field(default=1.0) # share of new, relevant chunks in the last research loop's top results
     research_loop_count : int = field(default=0) # research loop count - for iteration tracking
+    summary_sections : Annotated[list, operator.add] = field(default_factory=list) # one summary section per research loop
     final_summary: str = field(default=None) # final report
 
 # summary state input object -  to let user define the research topic
@@ -0,0 +1,76 @@
+TRUNCATION_MARKER = " ... [truncated]"
+
+
+class TokenCounter:
+    """Counts and truncates text in model tokens.
+
+    Uses the tiktoken encoding if tiktoken is installed and the encoding can be loaded (it is
+    downloaded on first use), otherwise falls back to an estimate of 4 characters per token.
+    """
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(f"Warning: tokenizer '{encoding_name}' not available ({type(e).__name__}), estimating 4 characters per token")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_messages(self, messages: list) -> int:
+        """Counts the tokens of chat messages including a few tokens of per-message overhead."""
+        return sum(self.count(message.get("content") or "") + 4 for message in messages) + 2
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cuts text to at most max_tokens tokens, marker included, keeping the beginning."""
+        if self.count(text) <= max_tokens:
+            return text
+        keep = max(0, max_tokens - self.count(TRUNCATION_MARKER))
+        if self.encoding is not None:
+            head = self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:keep])
+        else:
+            head = text[:keep * 4]
+        return head + TRUNCATION_MARKER
+
+    def fit(self, texts: list, budget: int) -> list:
+        """Truncates texts so that together they stay within budget tokens.
+
+        Short texts are kept whole and the budget they leave over is shared by the longer ones,
+        so one long text cannot crowd out the others.
+        """
+        counts = [self.count(text) for text in texts]
+        allowed = [0] * len(texts)
+        remaining = max(0, budget)
+        pending = sorted(range(len(texts)), key=lambda i: counts[i])
+        while pending:
+            share = remaining // len(pending)
+            i = pending.pop(0)
+            allowed[i] = min(counts[i], share)
+            remaining -= allowed[i]
+        return [text if allowed[i] >= counts[i] else self.truncate(text, allowed[i])
+                for i, text in enumerate(texts)]
+
+
+class TokenBudget:
+    """Per-node prompt caps of the research graph."""
+
+    def __init__(self, counter: TokenCounter, summarizer_max_tokens: int, reflection_max_tokens: int,
+                 summary_context_tokens: int):
+        self.counter = counter
+        # Total prompt tokens of a summarize_sources call
+        self.summarizer_max_tokens = summarizer_max_tokens
+        # Total prompt tokens of a reflect_on_summary call
+        self.reflection_max_tokens = reflection_max_tokens
+        # Tokens of the already written sections the summarizer sees to avoid repeating them
+        self.summary_context_tokens = summary_context_tokens
+
+    def remaining(self, max_tokens: int, *fixed_texts: str) -> int:
+        """Tokens left for variable content after the fixed parts of a prompt."""
+        used = sum(self.counter.count(text) + 4 for text in fixed_texts) + 2
+        return max(0, max_tokens - used)
@@ -0,0 +1,91 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the call, callers arriving while it is in flight
+    await the same result instead of starting their own. Once it finished, the next call
+    for the key runs again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Returns the result of await fn(), shared with all concurrent callers using key."""
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None) if self._calls.get(key) is task else None)
+        else:
+            self.coalesced += 1
+        # A cancelled caller must not cancel the call the other callers are waiting for
+        return await asyncio.shield(task)
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent callers into batches for one fn(items) call.
+
+    A batch is sent when it reaches max_batch_size items or max_wait_seconds after its
+    first item arrived, whichever comes first. fn is a coroutine function returning one
+    result per item, in order.
+    """
+
+    def __init__(self, fn, max_batch_size: int = 64, max_wait_seconds: float = 0.005):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = []
+        self._timer = None
+        # Running batches, referenced so they are not garbage collected while in flight
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        """Adds item to the current batch and returns its result once the batch is done."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
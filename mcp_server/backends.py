@@ -0,0 +1,676 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from rate_limiter import create_rate_limiter
+
+
+class SearchHit:
+    """A search result, carries the same fields the tools read from Qdrant's ScoredPoint."""
+
+    __slots__ = ("id", "score", "payload", "vector")
+
+    def __init__(self, id, score: float, payload: dict, vector=None):
+        self.id = id
+        self.score = score
+        self.payload = payload
+        self.vector = vector
+
+
+def select_payload(payload: dict, with_payload) -> dict:
+    """Applies a with_payload argument in Qdrant's format: True, False or a list of field names."""
+    if with_payload is True:
+        return payload
+    if not with_payload:
+        return {}
+    return {field: payload[field] for field in with_payload if field in payload}
+
+
+def chunk_source(payload: dict) -> str:
+    """Identifies the file of a chunk: its source_path, the filename for points indexed before source_path."""
+    return payload.get("source_path") or payload.get("filename")
+
+
+def chunk_payload_fields(with_payload):
+    """Extends a with_payload argument of get_chunks by the fields that identify a chunk."""
+    if with_payload is True:
+        return True
+    return list(dict.fromkeys([*(with_payload or []), "source_path", "filename", "chunknumber"]))
+
+
+class Embedder:
+    """Turns texts into embedding vectors."""
+
+    # Part of the query embedding cache key, must change whenever the vectors change
+    model: str
+    dimensions: int
+    # RateLimiter of the embedding deployment, None for local embedders
+    limiter = None
+
+    def embed(self, texts: list) -> list:
+        """Returns one embedding per text, in input order."""
+        raise NotImplementedError
+
+    async def aembed(self, texts: list) -> list:
+        """Async embed, runs embed on a worker thread unless a backend has a native async client."""
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class AzureEmbedder(Embedder):
+    """Embeds texts with an Azure OpenAI embedding deployment."""
+
+    def __init__(self, model: str = None, dimensions: int = None):
+        from openai import AzureOpenAI
+        # Retries are left to the rate limiter, which all embedding requests of the process share
+        self.client = AzureOpenAI(
+            api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+            azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_API_KEY"],
+            max_retries=0
+        )
+        self.limiter = create_rate_limiter("EMBEDDING")
+        self.deployment = model or os.environ["AZURE_OPENAI_EMBEDDING_MODEL"]
+        # With dimensions the model returns shortened embeddings, which need their own cache entries
+        self.reduced_dimensions = dimensions
+        self.model = f"{self.deployment}@{dimensions}" if dimensions else self.deployment
+        self.dimensions = dimensions or 3072
+        # Created on first use, so that it belongs to the event loop of the server
+        self.async_client = None
+
+    def _request(self, texts: list) -> dict:
+        request = {"input": texts, "model": self.deployment}
+        if self.reduced_dimensions:
+            request["dimensions"] = self.reduced_dimensions
+        return request
+
+    @staticmethod
+    def _embeddings(response) -> list:
+        # The response carries the input position of every embedding, keep the input order
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    @staticmethod
+    def _estimated_tokens(texts: list) -> int:
+        # About 4 characters per token, corrected with the usage of the response
+        return sum(len(text) for text in texts) // 4 + 1
+
+    @staticmethod
+    def _used_tokens(response):
+        return getattr(getattr(response, "usage", None), "total_tokens", None)
+
+    def embed(self, texts: list) -> list:
+        request = self._request(texts)
+        response = self.limiter.call(lambda: self.client.embeddings.create(**request),
+                                     tokens=self._estimated_tokens(texts), usage=self._used_tokens)
+        return self._embeddings(response)
+
+    async def aembed(self, texts: list) -> list:
+        if self.async_client is None:
+            from openai import AsyncAzureOpenAI
+            self.async_client = AsyncAzureOpenAI(
+                api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+                azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+                api_key=os.environ["AZURE_OPENAI_API_KEY"],
+                max_retries=0
+            )
+        request = self._request(texts)
+        response = await self.limiter.acall(lambda: self.async_client.embeddings.create(**request),
+                                            tokens=self._estimated_tokens(texts), usage=self._used_tokens)
+        return self._embeddings(response)
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embedder for offline runs and benchmarks.
+
+    Words and character trigrams are hashed into a fixed number of signed buckets and
+    the resulting vector is L2-normalized. Texts sharing vocabulary get similar vectors,
+    which is enough to exercise retrieval without an embedding service.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+        self.model = f"local-hashing-{dimensions}"
+
+    def _features(self, text: str):
+        words = re.findall(r"\w+", text.casefold())
+        for word in words:
+            yield word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed(self, texts: list) -> list:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dimensions] += 1.0 if (digest >> 63) else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+        return vectors.tolist()
+
+
+QUANTIZATIONS = (None, "scalar", "binary")
+
+
+class VectorStore:
+    """Stores embedded chunks and searches them by cosine similarity.
+
+    With quantization ("scalar" for int8, "binary" for one bit per dimension) searches run on
+    compressed vectors held in memory: limit * oversampling candidates are found on the
+    compressed vectors and, with rescore, ranked again with the original vectors.
+    """
+
+    # Identifies the collection, e.g. for the indexer's manifest
+    name: str
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def initialize(self, dimensions: int) -> bool:
+        """Creates the collection if needed. Returns True if it was created."""
+        raise NotImplementedError
+
+    def upsert(self, ids: list, vectors: list, payloads: list):
+        raise NotImplementedError
+
+    def search(self, vector, limit: int, with_vectors: bool = False, with_payload=True,
+               score_threshold: float = None) -> list:
+        """Returns the limit best matching SearchHits, best first.
+
+        with_payload is True, False or a list of payload fields to return, hits scoring
+        below score_threshold are left out.
+        """
+        raise NotImplementedError
+
+    def search_batch(self, vectors: list, limit: int, with_vectors: bool = False, with_payload=True,
+                     score_threshold: float = None) -> list:
+        """Returns one list of SearchHits per query vector."""
+        return [self.search(vector, limit, with_vectors, with_payload, score_threshold) for vector in vectors]
+
+    async def asearch(self, vector, limit: int, with_vectors: bool = False, with_payload=True,
+                      score_threshold: float = None) -> list:
+        """Async search, runs search on a worker thread unless a backend has a native async client."""
+        return await asyncio.to_thread(self.search, vector, limit, with_vectors, with_payload, score_threshold)
+
+    async def asearch_batch(self, vectors: list, limit: int, with_vectors: bool = False, with_payload=True,
+                            score_threshold: float = None) -> list:
+        return await asyncio.to_thread(self.search_batch, vectors, limit, with_vectors, with_payload, score_threshold)
+
+    def get_chunks(self, ranges: list, with_payload=True) -> list:
+        """Returns the payloads of the chunks in (source, first_chunknumber, last_chunknumber) ranges.
+
+        source is the chunk_source of the file, so files with the same name in different
+        folders are told apart. The payloads always include source_path and filename.
+        """
+        raise NotImplementedError
+
+    async def aget_chunks(self, ranges: list, with_payload=True) -> list:
+        return await asyncio.to_thread(self.get_chunks, ranges, with_payload)
+
+    def delete(self, source_path: str, keep_file_hash: str = None):
+        """Deletes the points of a source file, except those written for keep_file_hash."""
+        raise NotImplementedError
+
+    def persist(self):
+        """Makes all writes durable, a no-op for stores that write through."""
+
+
+class QdrantVectorStore(VectorStore):
+    """Vector store backed by a Qdrant collection."""
+
+    def __init__(self, url: str, collection_name: str, quantization: str = None,
+                 oversampling: float = 2.0, rescore: bool = True):
+        from qdrant_client import QdrantClient, models
+        self.models = models
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self.rescore = rescore
+        self.url = url
+        self.client = QdrantClient(url=url)
+        # Created on first use, so that it belongs to the event loop of the server
+        self.async_client = None
+        self.collection_name = collection_name
+        self.name = collection_name
+
+    def _async_client(self):
+        if self.async_client is None:
+            from qdrant_client import AsyncQdrantClient
+            self.async_client = AsyncQdrantClient(url=self.url)
+        return self.async_client
+
+    def exists(self) -> bool:
+        return self.client.collection_exists(self.collection_name)
+
+    def _create_payload_indexes(self):
+        models = self.models
+        # Stale chunks are deleted by source file, neighbor chunks are fetched by file and chunk number
+        for field_name, field_schema in (("source_path", models.PayloadSchemaType.KEYWORD),
+                                         ("filename", models.PayloadSchemaType.KEYWORD),
+                                         ("chunknumber", models.PayloadSchemaType.INTEGER)):
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+
+    def initialize(self, dimensions: int) -> bool:
+        models = self.models
+        if self.exists():
+            # Collections created before the neighbor lookup get the missing indexes, existing ones are kept
+            self._create_payload_indexes()
+            return False
+        quantization_config = None
+        if self.quantization == "scalar":
+            quantization_config = models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+        elif self.quantization == "binary":
+            quantization_config = models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True))
+        self.client.create_collection(
+            collection_name=self.collection_name,
+            vectors_config=models.VectorParams(
+                size=dimensions,  # Size of the vector
+                distance=models.Distance.COSINE,  # Distance metric
+                # Only the quantized vectors stay in RAM, the originals are read from disk for rescoring
+                on_disk=quantization_config is not None
+            ),
+            quantization_config=quantization_config
+        )
+        self._create_payload_indexes()
+        return True
+
+    def upsert(self, ids: list, vectors: list, payloads: list):
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                self.models.PointStruct(id=point_id, vector=vector, payload=payload)
+                for point_id, vector, payload in zip(ids, vectors, payloads)
+            ]
+        )
+
+    def _search_params(self):
+        if not self.quantization:
+            return None
+        return self.models.SearchParams(quantization=self.models.QuantizationSearchParams(
+            rescore=self.rescore, oversampling=self.oversampling))
+
+    @staticmethod
+    def _hits(response) -> list:
+        return [SearchHit(point.id, point.score, point.payload, point.vector) for point in response.points]
+
+    def search(self, vector, limit: int, with_vectors: bool = False, with_payload=True,
+               score_threshold: float = None) -> list:
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            query=vector,
+            limit=limit,
+            search_params=self._search_params(),
+            score_threshold=score_threshold,
+            with_payload=with_payload,
+            with_vectors=with_vectors
+        )
+        return self._hits(response)
+
+    def search_batch(self, vectors: list, limit: int, with_vectors: bool = False, with_payload=True,
+                     score_threshold: float = None) -> list:
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                self.models.QueryRequest(query=vector, limit=limit, params=self._search_params(),
+                                         score_threshold=score_threshold, with_payload=with_payload,
+                                         with_vector=with_vectors)
+                for vector in vectors
+            ]
+        )
+        return [self._hits(response) for response in responses]
+
+    async def asearch(self, vector, limit: int, with_vectors: bool = False, with_payload=True,
+                      score_threshold: float = None) -> list:
+        response = await self._async_client().query_points(
+            collection_name=self.collection_name,
+            query=vector,
+            limit=limit,
+            search_params=self._search_params(),
+            score_threshold=score_threshold,
+            with_payload=with_payload,
+            with_vectors=with_vectors
+        )
+        return self._hits(response)
+
+    async def asearch_batch(self, vectors: list, limit: int, with_vectors: bool = False, with_payload=True,
+                            score_threshold: float = None) -> list:
+        responses = await self._async_client().query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                self.models.QueryRequest(query=vector, limit=limit, params=self._search_params(),
+                                         score_threshold=score_threshold, with_payload=with_payload,
+                                         with_vector=with_vectors)
+                for vector in vectors
+            ]
+        )
+        return [self._hits(response) for response in responses]
+
+    def _chunk_filter(self, ranges: list):
+        models = self.models
+        # One condition per range, all ranges are fetched by the same scroll
+        return models.Filter(should=[
+            models.Filter(must=[
+                models.Filter(should=[
+                    models.FieldCondition(key="source_path", match=models.MatchValue(value=source)),
+                    # Points indexed before source_path are matched by their filename
+                    models.Filter(must=[
+                        models.FieldCondition(key="filename", match=models.MatchValue(value=source)),
+                        models.IsEmptyCondition(is_empty=models.PayloadField(key="source_path"))
+                    ])
+                ]),
+                models.FieldCondition(key="chunknumber", range=models.Range(gte=first, lte=last))
+            ])
+            for source, first, last in ranges
+        ])
+
+
+    def get_chunks(self, ranges: list, with_payload=True) -> list:
+        if not ranges:
+            return []
+        points, offset = [], None
+        limit = sum(last - first + 1 for _, first, last in ranges)
+        while True:
+            page, offset = self.client.scroll(collection_name=self.collection_name, scroll_filter=self._chunk_filter(ranges),
+                                              limit=limit, offset=offset,
+                                              with_payload=chunk_payload_fields(with_payload))
+            points.extend(page)
+            # More pages only if a range matched several versions of a chunk during re-indexing
+            if offset is None:
+                return [point.payload for point in points]
+
+    async def aget_chunks(self, ranges: list, with_payload=True) -> list:
+        if not ranges:
+            return []
+        points, offset = [], None
+        limit = sum(last - first + 1 for _, first, last in ranges)
+        while True:
+            page, offset = await self._async_client().scroll(collection_name=self.collection_name,
+                                                             scroll_filter=self._chunk_filter(ranges),
+                                                             limit=limit, offset=offset,
+                                                             with_payload=chunk_payload_fields(with_payload))
+            points.extend(page)
+            if offset is None:
+                return [point.payload for point in points]
+
+    def delete(self, source_path: str, keep_file_hash: str = None):
+        models = self.models
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(
+                    must=[models.FieldCondition(key="source_path", match=models.MatchValue(value=source_path))],
+                    must_not=[models.FieldCondition(key="file_hash", match=models.MatchValue(value=keep_file_hash))]
+                    if keep_file_hash else None
+                )
+            )
+        )
+
+
+class LocalVectorStore(VectorStore):
+    """In-memory NumPy vector store with optional persistence to a directory.
+
+    Vectors are kept L2-normalized in one float32 matrix, so a cosine search is a single
+    matrix-vector product followed by a partial sort. A persisted store is opened as a
+    read-only memory map and only copied into memory once it is written to. With
+    quantization, the compressed vectors are built in memory on the first search and the
+    memory-mapped originals are only read for the rescored candidates.
+    """
+
+    # Bits set per byte value, for the Hamming distance of binary codes
+    _POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+    # Rows per block when scoring int8 codes, bounds the temporary float32 copy
+    _BLOCK_ROWS = 8192
+
+    def __init__(self, path: str = None, quantization: str = None, oversampling: float = 2.0, rescore: bool = True):
+        self.path = path
+        self.quantization = quantization
+        self.oversampling = oversampling
+        self.rescore = rescore
+        self._codes = None
+        self._scale = 1.0
+        self.name = f"local:{os.path.abspath(path)}" if path else "local"
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._size = 0
+        self._ids = []
+        self._payloads = []
+        self._rows = {}
+        # (chunk_source, chunknumber) -> rows, built on the first neighbor lookup
+        self._chunk_rows = None
+        if path and os.path.exists(os.path.join(path, "vectors.npy")):
+            self._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            with open(os.path.join(path, "payloads.jsonl"), 'r', encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._rows[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._payloads.append(record["payload"])
+            self._size = len(self._ids)
+
+    def exists(self) -> bool:
+        return self._vectors is not None
+
+    def initialize(self, dimensions: int) -> bool:
+        with self._lock:
+            if self._vectors is not None:
+                return False
+            self._vectors = np.zeros((0, dimensions), dtype=np.float32)
+            return True
+
+    def __len__(self):
+        return self._size
+
+    def _writable(self, capacity: int):
+        # Grow geometrically so repeated upserts stay amortized O(1) per row
+        if not isinstance(self._vectors, np.memmap) and self._vectors.shape[0] >= capacity:
+            return
+        new_capacity = max(capacity, 2 * self._vectors.shape[0], 1024)
+        vectors = np.zeros((new_capacity, self._vectors.shape[1]), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def upsert(self, ids: list, vectors: list, payloads: list):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            self._writable(self._size + len(ids))
+            self._codes = None
+            self._chunk_rows = None
+            for point_id, vector, payload in zip(ids, vectors, payloads):
+                row = self._rows.get(point_id)
+                if row is None:
+                    row = self._size
+                    self._rows[point_id] = row
+                    self._ids.append(point_id)
+                    self._payloads.append(payload)
+                    self._size += 1
+                else:
+                    self._payloads[row] = payload
+                self._vectors[row] = vector
+
+    def _top_k(self, scores: np.ndarray, limit: int) -> np.ndarray:
+        if limit >= scores.shape[-1]:
+            return np.argsort(-scores, axis=-1)
+        top = np.argpartition(-scores, limit - 1, axis=-1)[..., :limit]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+        return np.take_along_axis(top, order, axis=-1)
+
+    def _to_hits(self, rows, scores, with_vectors: bool, with_payload=True, score_threshold: float = None) -> list:
+        return [
+            SearchHit(self._ids[row], float(score), select_payload(self._payloads[row], with_payload),
+                      self._vectors[row].tolist() if with_vectors else None)
+            for row, score in zip(rows, scores)
+            if score_threshold is None or score >= score_threshold
+        ]
+
+    def search(self, vector, limit: int, with_vectors: bool = False, with_payload=True,
+               score_threshold: float = None) -> list:
+        return self.search_batch([vector], limit, with_vectors, with_payload, score_threshold)[0]
+
+    def _quantized_codes(self):
+        if self._codes is None:
+            vectors = self._vectors[:self._size]
+            if self.quantization == "scalar":
+                # Like Qdrant, clip the outliers above the 0.99 quantile to keep int8 resolution for the rest;
+                # zeros are left out so that sparse vectors do not push the quantile towards zero
+                magnitudes = np.abs(vectors[vectors != 0])
+                self._scale = 127.0 / max(float(np.quantile(magnitudes, 0.99)) if magnitudes.size else 1.0, 1e-6)
+                self._codes = np.clip(np.rint(vectors * self._scale), -127, 127).astype(np.int8)
+            else:
+                self._codes = np.packbits(vectors > 0, axis=1)
+        return self._codes
+
+    def _coarse_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Approximate cosine scores of all queries against the quantized vectors."""
+        codes = self._quantized_codes()
+        if self.quantization == "scalar":
+            scaled = (queries * self._scale).T
+            return np.concatenate([
+                codes[start:start + self._BLOCK_ROWS].astype(np.float32) @ scaled
+                for start in range(0, self._size, self._BLOCK_ROWS)
+            ]).T / (self._scale * self._scale)
+        dimensions = queries.shape[1]
+        scores = np.empty((len(queries), self._size), dtype=np.float32)
+        for i, query_bits in enumerate(np.packbits(queries > 0, axis=1)):
+            hamming = self._POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1)
+            scores[i] = 1.0 - 2.0 * hamming / dimensions
+        return scores
+
+    def _quantized_search(self, queries: np.ndarray, limit: int, with_vectors: bool, with_payload=True,
+                          score_threshold: float = None) -> list:
+        coarse = self._coarse_scores(queries)
+        candidates = self._top_k(coarse, min(self._size, int(np.ceil(limit * self.oversampling))))
+        results = []
+        for query, rows, query_scores in zip(queries, candidates, coarse):
+            if self.rescore:
+                # Fancy indexing reads only the candidate rows of a memory-mapped store
+                exact = self._vectors[np.sort(rows)] @ query
+                rows = np.sort(rows)
+                order = np.argsort(-exact)[:limit]
+                rows, scores = rows[order], exact[order]
+            else:
+                rows = rows[:limit]
+                scores = query_scores[rows]
+            results.append(self._to_hits(rows, scores, with_vectors, with_payload, score_threshold))
+        return results
+
+    def search_batch(self, vectors: list, limit: int, with_vectors: bool = False, with_payload=True,
+                     score_threshold: float = None) -> list:
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+        with self._lock:
+            if not self._size or limit <= 0:
+                return [[] for _ in vectors]
+            if self.quantization:
+                return self._quantized_search(queries, limit, with_vectors, with_payload, score_threshold)
+            # One matrix product scores all queries against all stored vectors
+            scores = queries @ self._vectors[:self._size].T
+            top = self._top_k(scores, limit)
+            return [self._to_hits(rows, query_scores[rows], with_vectors, with_payload, score_threshold)
+                    for rows, query_scores in zip(top, scores)]
+
+    def memory_bytes(self) -> int:
+        """Bytes of vector data held in memory; a memory-mapped matrix is not counted."""
+        with self._lock:
+            total = 0
+            if self._vectors is not None and not isinstance(self._vectors, np.memmap):
+                total += self._vectors[:self._size].nbytes
+            if self.quantization and self._size:
+                total += self._quantized_codes().nbytes
+            return total
+
+    def delete(self, source_path: str, keep_file_hash: str = None):
+        with self._lock:
+            keep = [
+                row for row in range(self._size)
+                if self._payloads[row].get("source_path") != source_path
+                or (keep_file_hash and self._payloads[row].get("file_hash") == keep_file_hash)
+            ]
+            if len(keep) == self._size:
+                return
+            self._codes = None
+            self._chunk_rows = None
+            self._vectors = np.array(self._vectors[keep], dtype=np.float32)
+            self._ids = [self._ids[row] for row in keep]
+            self._payloads = [self._payloads[row] for row in keep]
+            self._rows = {point_id: row for row, point_id in enumerate(self._ids)}
+            self._size = len(keep)
+
+    def get_chunks(self, ranges: list, with_payload=True) -> list:
+        with self._lock:
+            if self._chunk_rows is None:
+                self._chunk_rows = {}
+                for row in range(self._size):
+                    payload = self._payloads[row]
+                    self._chunk_rows.setdefault((chunk_source(payload), payload.get("chunknumber")), []).append(row)
+            return [
+                select_payload(self._payloads[row], chunk_payload_fields(with_payload))
+                for source, first, last in ranges
+                for chunknumber in range(first, last + 1)
+                for row in self._chunk_rows.get((source, chunknumber), ())
+            ]
+
+    def persist(self):
+        if not self.path or self._vectors is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            # Write to temporary files first, readers never see a half written store
+            vectors_path = os.path.join(self.path, "vectors.npy")
+            payloads_path = os.path.join(self.path, "payloads.jsonl")
+            with open(f"{vectors_path}.tmp", 'wb') as f:
+                np.save(f, np.ascontiguousarray(self._vectors[:self._size]))
+            with open(f"{payloads_path}.tmp", 'w', encoding="utf-8") as f:
+                for point_id, payload in zip(self._ids, self._payloads):
+                    f.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n")
+            os.replace(f"{vectors_path}.tmp", vectors_path)
+            os.replace(f"{payloads_path}.tmp", payloads_path)
+
+
+def create_embedder() -> Embedder:
+    """Creates the embedder selected by the EMBEDDER environment variable (azure or local)."""
+    kind = os.environ.get("EMBEDDER", "azure").lower()
+    if kind == "local":
+        return HashingEmbedder(int(os.environ.get("LOCAL_EMBEDDING_DIMENSIONS", "384")))
+    if kind == "azure":
+        # Shortened embeddings, e.g. 1024 instead of 3072 dimensions, need a model supporting the dimensions parameter
+        dimensions = os.environ.get("EMBEDDING_DIMENSIONS")
+        return AzureEmbedder(dimensions=int(dimensions) if dimensions else None)
+    raise ValueError(f"Unknown EMBEDDER '{kind}', expected 'azure' or 'local'")
+
+
+def create_vector_store() -> VectorStore:
+    """Creates the vector store selected by the VECTOR_STORE environment variable (qdrant or local).
+
+    VECTOR_QUANTIZATION (none, scalar or binary), QUANTIZATION_OVERSAMPLING and
+    QUANTIZATION_RESCORE select the quantization profile.
+    """
+    kind = os.environ.get("VECTOR_STORE", "qdrant").lower()
+    quantization = os.environ.get("VECTOR_QUANTIZATION", "none").lower()
+    quantization = None if quantization in ("", "none") else quantization
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown VECTOR_QUANTIZATION '{quantization}', expected 'none', 'scalar' or 'binary'")
+    profile = {
+        "quantization": quantization,
+        "oversampling": float(os.environ.get("QUANTIZATION_OVERSAMPLING", "2.0")),
+        "rescore": os.environ.get("QUANTIZATION_RESCORE", "True").lower() in ("true", "1", "yes"),
+    }
+    if kind == "local":
+        return LocalVectorStore(os.environ.get("LOCAL_VECTOR_STORE_PATH") or None, **profile)
+    if kind == "qdrant":
+        return QdrantVectorStore(os.environ["QDRANT_URL"], os.environ["QDRANT_COLLECTION_NAME"], **profile)
+    raise ValueError(f"Unknown VECTOR_STORE '{kind}', expected 'qdrant' or 'local'")
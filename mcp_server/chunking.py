@@ -0,0 +1,92 @@
+import codecs
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from model import ChunkModel
+
+
+def iter_text(file_path, block_size=1 << 20):
+    """Yields the text of a UTF-8 file in blocks of about block_size bytes.
+
+    The incremental decoder keeps characters split across two blocks intact, undecodable
+    bytes are replaced with U+FFFD instead of failing the whole file.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def stream_chunks(file_path, chunk_size=1000, chunk_overlap=100, block_size=1 << 20):
+    """Yields the (chunk, start_index) pairs of a file without holding more than a few blocks of it in memory.
+
+    start_index is the character offset of the chunk in the file, None if the splitter could not
+    locate it. Neighbor chunks are merged by these offsets, see context_window.py.
+
+    The text is split window by window with the same RecursiveCharacterTextSplitter as a
+    whole-file split. Only chunks ending at least chunk_size characters before the end of the
+    window are emitted: the splitter merges pieces greedily from the left, so these chunks
+    cannot change when more text follows. The window then restarts at the first chunk that was
+    not emitted, which already starts with the overlap of its predecessor, so the overlap stays
+    correct across read boundaries.
+
+    Every chunk respects chunk_size and chunk_overlap and the chunks cover the whole file, but
+    they are not guaranteed to equal those of a whole-file split: around each window restart
+    the splitter sees different text and can choose different boundaries, shifting a few chunks
+    (and possibly the chunk numbers after them). Chunks away from the restarts are identical.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True
+    )
+    buffer = ""
+    # Character offset of the buffer in the file
+    base = 0
+    for text in iter_text(file_path, block_size):
+        buffer += text
+        if len(buffer) < block_size + 2 * chunk_size:
+            continue
+        safe_end = len(buffer) - chunk_size
+        restart = None
+        for document in splitter.create_documents([buffer]):
+            start = document.metadata["start_index"]
+            if start + len(document.page_content) > safe_end:
+                restart = start
+                break
+            yield document.page_content, _offset(base, start)
+        # Without a pending chunk only whitespace is left after safe_end
+        restart = restart if restart is not None and restart >= 0 else safe_end
+        buffer = buffer[restart:]
+        base += restart
+    if buffer:
+        for document in splitter.create_documents([buffer]):
+            yield document.page_content, _offset(base, document.metadata["start_index"])
+
+
+def iter_file_chunks(file_path, chunk_size=1000, chunk_overlap=100):
+    """Yields the chunks of a file as ChunkModel instances while reading it block by block."""
+    filename = os.path.basename(file_path)
+    source_path = os.path.normpath(file_path)
+    for i, (chunk, start_index) in enumerate(stream_chunks(file_path, chunk_size, chunk_overlap)):
+        yield ChunkModel(content=chunk, filename=filename, chunknumber=i, source_path=source_path, start_index=start_index)
+
+
+def split_file_to_chunks(file_path, chunk_size=1000, chunk_overlap=100):
+    """Splits a file into chunks of specified size.
+
+    Runs in the indexer's process pool, which imports this module (free of side effects)
+    instead of the indexing script under the spawn and forkserver start methods.
+    """
+    return list(iter_file_chunks(file_path, chunk_size, chunk_overlap))
+
+
+def _offset(base: int, start: int):
+    # The splitter reports -1 for a chunk it did not find in the text
+    return base + start if start >= 0 else None
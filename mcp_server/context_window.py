@@ -0,0 +1,45 @@
+def window_ranges(hits: list, window: int) -> list:
+    """Merges the windows chunknumber - window .. chunknumber + window of the hits per file.
+
+    hits are (source, chunknumber, score) tuples, best first, source identifies the file. Returns one
+    (source, first, last, hit_chunknumber, score) tuple per passage, ordered by the best
+    hit it contains; windows of the same file that overlap or touch become one passage.
+    """
+    by_file = {}
+    for rank, (source, chunknumber, score) in enumerate(hits):
+        by_file.setdefault(source, []).append((max(0, chunknumber - window), chunknumber + window, rank, chunknumber, score))
+    passages = []
+    for source, windows in by_file.items():
+        windows.sort()
+        current = None
+        for first, last, rank, chunknumber, score in windows:
+            if current is not None and first <= current[2] + 1:
+                current[2] = max(current[2], last)
+                if rank < current[0]:
+                    current[0], current[3], current[4] = rank, chunknumber, score
+                continue
+            if current is not None:
+                passages.append(current)
+            current = [rank, first, last, chunknumber, score, source]
+        passages.append(current)
+    passages.sort()
+    return [(source, first, last, chunknumber, score) for _, first, last, chunknumber, score, source in passages]
+
+
+def merge_chunks(chunks: list) -> str:
+    """Joins consecutive chunks of a file into one text.
+
+    chunks are (content, start_index) pairs in file order, start_index being the character
+    offset stored by the indexer. A chunk starting before the end of its predecessor only adds
+    the text after that end, chunks with a gap in between (the whitespace the splitter dropped)
+    are joined with a blank line. Without offsets (points indexed before start_index was stored)
+    chunks are joined with a blank line and their overlap is kept, as text is never guessed away.
+    """
+    merged, end = "", None
+    for content, start in chunks:
+        if merged and start is not None and end is not None and start <= end:
+            merged += content[end - start:]
+        else:
+            merged = f"{merged}\n\n{content}" if merged else content
+        end = max(end or 0, start + len(content)) if start is not None else None
+    return merged
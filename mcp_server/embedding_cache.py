@@ -0,0 +1,165 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a query so trivially different spellings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class EmbeddingCache:
+    """Two-tier cache for query embeddings keyed by (model, normalized query).
+
+    The first tier is an in-process LRU whose entries expire after a TTL. The optional
+    second tier is a SQLite database that survives restarts and can be shared by several
+    server workers. Embeddings are stored there as float32 blobs and expire after the same
+    TTL, counted from when they were written; expired rows and the oldest rows beyond
+    max_disk_entries are pruned every prune_interval writes. aget_or_embed reads the database
+    in a worker thread and writes to it behind the response, so a lock held by another worker
+    does not stall the event loop.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, sqlite_path: str = None,
+                 max_disk_entries: int = 100000, prune_interval: int = 1000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.prune_interval = prune_interval
+        self._writes = 0
+        self._entries = OrderedDict()
+        # Guards the LRU and the counters, never held during database I/O
+        self._lock = threading.Lock()
+        # Serializes the use of the shared SQLite connection
+        self._db_lock = threading.Lock()
+        # Write-behind tasks of aget_or_embed, referenced until they are done
+        self._pending_writes = set()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=30)
+            # WAL lets several server processes read while one of them writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, embedding BLOB NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (model, query))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS query_embeddings_created ON query_embeddings (created)")
+            self._db.commit()
+            self._prune()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            embedding, expires = entry
+            if expires > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+            del self._entries[key]
+            return None
+
+    def _disk_get(self, key):
+        """Returns the embedding of a row that has not expired and its remaining lifetime, or None."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT embedding, created FROM query_embeddings WHERE model = ? AND query = ?", key
+            ).fetchone()
+        # created is wall-clock time, as other workers share the rows
+        remaining = row[1] + self.ttl_seconds - time.time() if row is not None else 0
+        if remaining <= 0:
+            return None
+        embedding = array('f')
+        embedding.frombytes(row[0])
+        return embedding.tolist(), remaining
+
+    def _loaded(self, key, found, now):
+        embedding, remaining = found
+        with self._lock:
+            # The entry keeps the expiry of its row instead of starting a new TTL
+            self._remember(key, embedding, now, remaining)
+            self.disk_hits += 1
+        return embedding
+
+    def _disk_put(self, key, embedding):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, embedding, created) VALUES (?, ?, ?, ?)",
+                (*key, array('f', embedding).tobytes(), time.time())
+            )
+            self._db.commit()
+            self._writes += 1
+            if self._writes % self.prune_interval == 0:
+                self._prune()
+
+    def _prune(self):
+        """Deletes expired rows and the oldest rows beyond max_disk_entries."""
+        self._db.execute("DELETE FROM query_embeddings WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM query_embeddings WHERE rowid IN "
+            "(SELECT rowid FROM query_embeddings ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+        self._db.commit()
+
+    async def aget_or_embed(self, model: str, query: str, aembed):
+        """Returns the cached embedding of the query or computes it with await aembed(query)."""
+        start = time.perf_counter()
+        key = (model, normalize_query(query))
+        now = time.monotonic()
+        embedding = self._memory_get(key, now)
+        if embedding is None and self._db is not None:
+            found = await asyncio.to_thread(self._disk_get, key)
+            if found is not None:
+                embedding = self._loaded(key, found, now)
+        if embedding is not None:
+            with self._lock:
+                self.hit_seconds += time.perf_counter() - start
+            return embedding
+        embedding = await aembed(query)
+        with self._lock:
+            self._remember(key, embedding, time.monotonic())
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - start
+        if self._db is not None:
+            # Write-behind: the embedding is returned while the row is written in a worker thread
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._disk_put, key, embedding))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._write_done)
+        return embedding
+
+    def _write_done(self, task):
+        self._pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Warning: could not store a query embedding ({task.exception()})")
+
+    def _remember(self, key, embedding, now, ttl_seconds: float = None):
+        self._entries[key] = (embedding, now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returns hit-rate and latency counters."""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "avg_hit_ms": 1000 * self.hit_seconds / hits if hits else 0.0,
+            "avg_miss_ms": 1000 * self.miss_seconds / self.misses if self.misses else 0.0,
+        }
@@ -1,100 +1,106 @@
-from qdrant_client import QdrantClient, models
 import glob
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from openai import AzureOpenAI
 
 # Load environment variables from .env if present
 from dotenv import load_dotenv
-from model import ChunkModel
+from chunking import iter_file_chunks, split_file_to_chunks
+from indexing_pipeline import IndexingPipeline
+from manifest import IndexManifest, chunk_point_id, hash_file
+from backends import create_embedder, create_vector_store
 load_dotenv()
 
-qdrant_client = QdrantClient(url=os.environ["QDRANT_URL"])
-collection_name = os.environ["QDRANT_COLLECTION_NAME"]
-azure_client = AzureOpenAI(
-    api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-    azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-    api_key=os.environ["AZURE_OPENAI_API_KEY"]
-)
+# Qdrant and Azure OpenAI by default, see VECTOR_STORE and EMBEDDER for the local backends
+vector_store = create_vector_store()
+embedder = create_embedder()
+# Number of chunk texts sent per embeddings.create call
+embedding_batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+# Number of points written per Qdrant upsert call
+upsert_batch_size = int(os.environ.get("UPSERT_BATCH_SIZE", "256"))
+# Number of threads sending embedding requests concurrently
+embedding_workers = int(os.environ.get("INDEX_EMBEDDING_WORKERS", "4"))
+# Number of processes splitting files into chunks, defaults to the CPU count
+split_processes = int(os.environ["INDEX_SPLIT_PROCESSES"]) if os.environ.get("INDEX_SPLIT_PROCESSES") else None
+# Number of batches buffered between two pipeline stages
+queue_size = int(os.environ.get("INDEX_QUEUE_SIZE", "8"))
+# Files larger than this are chunked while they are read instead of in the process pool
+stream_threshold_bytes = int(float(os.environ.get("INDEX_STREAM_THRESHOLD_MB", "64")) * 1024 * 1024)
+# Skip files whose content hash matches the manifest of the previous run
+incremental = os.environ.get("INDEX_INCREMENTAL", "True").lower() in ("true", "1", "yes")
+manifest_path = os.environ.get("INDEX_MANIFEST_PATH", ".index-manifest.json")
 
 def initialize_collection():
-    """Initializes the Qdrant collection."""
-    # Create a collection with the specified parameters
-    if not qdrant_client.collection_exists(collection_name):
-        qdrant_client.create_collection(
-            collection_name=collection_name,
-            vectors_config=models.VectorParams(
-                size=3072,  # Size of the vector
-                distance=models.Distance.COSINE,  # Distance metric
-            )
-        )
+    """Initializes the collection of the vector store. Returns True if the collection was created."""
+    return vector_store.initialize(embedder.dimensions)
 
-def split_file_to_chunks(file_path, chunk_size=1000, chunk_overlap=100):
-    """Splits a file into chunks of specified size."""
-    with open(file_path, 'rb') as f:
-        #read all file text
-        file_text = f.read().decode("utf-8")
-        # Split the text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
-        chunks = text_splitter.split_text(file_text)
-        filename = os.path.basename(file_path)
-        # Map each chunk to a ChunkModel instance with chunk number
-        chunks = [
-            ChunkModel(content=chunk, filename=filename, chunknumber=i)
-            for i, chunk in enumerate(chunks)
-        ]
-        return chunks
-    
-def embed_chunk(chunk):
-    """Embeds a chunk of text using Azure OpenAI embedding."""
+def embed_chunks(chunks):
+    """Embeds a batch of chunks with a single embedding request."""
 
-    response = azure_client.embeddings.create(input=chunk.content, 
-                                              model=os.environ["AZURE_OPENAI_EMBEDDING_MODEL"])
+    return embedder.embed([chunk.content for chunk in chunks])
 
-    return response.data[0].embedding
-
-def store_document_in_qdrant(chunks):
-    """Stores the document chunks in Qdrant."""
-    id_counter = 0
+def upsert_chunks(chunks, embeddings, file_hashes):
+    """Writes embedded chunks to the vector store under stable IDs, tagged with the hash of their file."""
+    payloads = []
     for chunk in chunks:
-        # Embed the chunk
-        embedding = embed_chunk(chunk)
-        # Store the chunk in Qdrant
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=id_counter,  # Use a unique ID for each chunk
-                    vector=embedding,
-                    payload={
-                        "content": chunk.content,
-                        "filename": chunk.filename,
-                        "chunknumber": chunk.chunknumber
-                    }
-                )
-            ]
-        )
-
-        id_counter += 1
+        payload = {
+            "content": chunk.content,
+            "filename": chunk.filename,
+            "chunknumber": chunk.chunknumber,
+            "source_path": chunk.source_path,
+            "start_index": chunk.start_index,
+            "file_hash": file_hashes[chunk.source_path]
+        }
+        payloads.append(payload)
+    vector_store.upsert(
+        ids=[chunk_point_id(chunk.source_path or chunk.filename, chunk.chunknumber, chunk.content) for chunk in chunks],
+        vectors=embeddings,
+        payloads=payloads
+    )
 
 def main():
-    initialize_collection()
+    created = initialize_collection()
     subfolder = os.environ.get("DOCS_SUBFOLDER", "docs")
     file_names = glob.glob(os.path.join(subfolder, "**", "*.*"), recursive=True)
 
-    all_chunks = []
-    for file_path in file_names:
-        # Split the file into chunks
-        chunks = split_file_to_chunks(file_path)
-        all_chunks.extend(chunks)
-        print(f"Read {len(chunks)} chunks from {file_path}")
+    manifest = IndexManifest(manifest_path, vector_store.name)
+    if created:
+        # A new collection contains nothing of the previous run
+        manifest.clear()
+    file_hashes = {os.path.normpath(file_path): hash_file(file_path) for file_path in file_names}
+    changed, removed = manifest.diff(file_hashes)
+    if not incremental:
+        # A full run re-embeds every file but still drops the files removed since the last run
+        changed = list(file_hashes)
+    print(f"{len(changed)} new or changed files, {len(file_hashes) - len(changed)} unchanged, {len(removed)} removed")
+
+    def write_chunks(chunks, embeddings):
+        upsert_chunks(chunks, embeddings, file_hashes)
+
+    pipeline = IndexingPipeline(
+        split_file=split_file_to_chunks,
+        stream_file=iter_file_chunks,
+        stream_threshold_bytes=stream_threshold_bytes,
+        embed_batch=embed_chunks,
+        write_batch=write_chunks,
+        embedding_workers=embedding_workers,
+        split_processes=split_processes,
+        queue_size=queue_size,
+        embedding_batch_size=embedding_batch_size,
+        upsert_batch_size=upsert_batch_size
+    )
+    pipeline.run(changed)
 
-    print(f"Total chunks: {len(all_chunks)}")
-    store_document_in_qdrant(all_chunks)
-    print("All documents stored in Qdrant.")
+    # New chunks are written first, then the chunks of the previous file versions are dropped
+    for source_path in changed:
+        vector_store.delete(source_path, keep_file_hash=file_hashes[source_path])
+        manifest.update(source_path, file_hashes[source_path])
+    for source_path in removed:
+        vector_store.delete(source_path)
+        manifest.remove(source_path)
+    vector_store.persist()
+    manifest.save()
+    if embedder.limiter is not None:
+        print(f"Embedding rate limiter: {embedder.limiter.stats()}")
+    print("All documents stored in the vector store.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
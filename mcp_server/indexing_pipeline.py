@@ -0,0 +1,189 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Marks the end of a stage's output in the queues between the stages
+_DONE = object()
+
+
+class IndexingPipeline:
+    """Indexes files with overlapping split, embed and write stages.
+
+    Files are split into chunks in a process pool, files above stream_threshold_bytes are
+    chunked while they are read so they are never held in memory. Chunk batches are embedded by a
+    number of worker threads and a single writer thread upserts the embedded points.
+    The stages are connected by bounded queues, so a slow stage blocks the stages in
+    front of it instead of letting chunks pile up in memory.
+    """
+
+    def __init__(self, split_file, embed_batch, write_batch, stream_file=None, stream_threshold_bytes=None,
+                 embedding_workers=4, split_processes=None, queue_size=8,
+                 embedding_batch_size=64, upsert_batch_size=256):
+        """
+        Args:
+            split_file: Picklable function mapping a file path to a list of ChunkModel
+            embed_batch: Function mapping a list of chunks to a list of embeddings
+            write_batch: Function storing a list of chunks with their embeddings
+            stream_file: Function mapping a file path to an iterator of ChunkModel, used for large files
+            stream_threshold_bytes: Size above which a file is streamed with stream_file
+            embedding_workers: Number of threads sending embedding requests
+            split_processes: Number of processes splitting files, defaults to the CPU count
+            queue_size: Number of batches buffered between two stages
+            embedding_batch_size: Number of chunks per embedding request
+            upsert_batch_size: Number of chunks per write
+        """
+        self.split_file = split_file
+        self.embed_batch = embed_batch
+        self.write_batch = write_batch
+        self.stream_file = stream_file
+        self.stream_threshold_bytes = stream_threshold_bytes
+        self.embedding_workers = max(1, embedding_workers)
+        self.split_processes = split_processes or os.cpu_count() or 1
+        self.embedding_batch_size = embedding_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self._embed_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._errors = []
+        self.files_processed = 0
+        self.chunks_stored = 0
+
+    def run(self, file_paths):
+        """Runs all stages over the given files and returns the number of stored chunks."""
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._guard, args=(self._produce, file_paths), name="index-split")]
+        threads += [
+            threading.Thread(target=self._guard, args=(self._embed,), name=f"index-embed-{i}")
+            for i in range(self.embedding_workers)
+        ]
+        threads.append(threading.Thread(target=self._guard, args=(self._write, start), name="index-write"))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+        elapsed = time.perf_counter() - start
+        rate = self.chunks_stored / elapsed if elapsed > 0 else 0.0
+        print(f"Indexed {self.chunks_stored} chunks from {self.files_processed} files in {elapsed:.1f}s ({rate:.1f} chunks/sec)")
+        return self.chunks_stored
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, target_queue, item):
+        # Blocks while the next stage is busy, gives up once another stage failed
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source_queue):
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _produce(self, file_paths):
+        try:
+            with ProcessPoolExecutor(max_workers=self.split_processes) as executor:
+                paths = iter(file_paths)
+                pending = {}
+                # Keep only a few files in flight per process, the rest waits on disk
+                max_pending = self.split_processes * 2
+                while not self._stop.is_set():
+                    for file_path in paths:
+                        if self._should_stream(file_path):
+                            if not self._produce_stream(file_path):
+                                return
+                            continue
+                        pending[executor.submit(self.split_file, file_path)] = file_path
+                        if len(pending) >= max_pending:
+                            break
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path = pending.pop(future)
+                        chunks = future.result()
+                        print(f"Read {len(chunks)} chunks from {file_path}")
+                        self.files_processed += 1
+                        for i in range(0, len(chunks), self.embedding_batch_size):
+                            if not self._put(self._embed_queue, chunks[i:i + self.embedding_batch_size]):
+                                return
+                for future in pending:
+                    future.cancel()
+        finally:
+            for _ in range(self.embedding_workers):
+                self._put(self._embed_queue, _DONE)
+
+    def _should_stream(self, file_path):
+        return (self.stream_file is not None and self.stream_threshold_bytes is not None
+                and os.path.getsize(file_path) > self.stream_threshold_bytes)
+
+    def _produce_stream(self, file_path):
+        # Only the current batch of a large file is in memory, the bounded queue throttles the reading
+        count = 0
+        batch = []
+        for chunk in self.stream_file(file_path):
+            batch.append(chunk)
+            if len(batch) >= self.embedding_batch_size:
+                if not self._put(self._embed_queue, batch):
+                    return False
+                count += len(batch)
+                batch = []
+        if batch:
+            if not self._put(self._embed_queue, batch):
+                return False
+            count += len(batch)
+        print(f"Streamed {count} chunks from {file_path}")
+        self.files_processed += 1
+        return True
+
+    def _embed(self):
+        try:
+            while True:
+                chunks = self._get(self._embed_queue)
+                if chunks is _DONE:
+                    return
+                embeddings = self.embed_batch(chunks)
+                if not self._put(self._write_queue, (chunks, embeddings)):
+                    return
+        finally:
+            self._put(self._write_queue, _DONE)
+
+    def _write(self, start):
+        running_workers = self.embedding_workers
+        chunks, embeddings = [], []
+        while running_workers:
+            item = self._get(self._write_queue)
+            if item is _DONE:
+                if self._stop.is_set():
+                    return
+                running_workers -= 1
+                continue
+            chunks.extend(item[0])
+            embeddings.extend(item[1])
+            while len(chunks) >= self.upsert_batch_size:
+                self._flush(chunks[:self.upsert_batch_size], embeddings[:self.upsert_batch_size], start)
+                chunks, embeddings = chunks[self.upsert_batch_size:], embeddings[self.upsert_batch_size:]
+        if chunks:
+            self._flush(chunks, embeddings, start)
+
+    def _flush(self, chunks, embeddings, start):
+        self.write_batch(chunks, embeddings)
+        self.chunks_stored += len(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"Stored {self.chunks_stored} chunks ({self.chunks_stored / elapsed:.1f} chunks/sec)")
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+import uuid
+
+# Namespace for the deterministic point IDs of indexed chunks
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3b0e-7a43-4c55-9a8e-2d3f6b8e51a4")
+
+
+def hash_file(file_path, block_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_point_id(filename, chunknumber, content):
+    """Derives a stable Qdrant point ID from the chunk's file, position and content."""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{filename}:{chunknumber}:{content_hash}"))
+
+
+class IndexManifest:
+    """Persistent record of the files indexed into a collection and their content hashes."""
+
+    def __init__(self, path, collection_name):
+        self.path = path
+        self.collection_name = collection_name
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+            # A manifest written for another collection says nothing about this one
+            if data.get("collection") == collection_name:
+                self.files = data.get("files", {})
+
+    def diff(self, file_hashes):
+        """Compares the current file hashes with the manifest.
+
+        Returns:
+            tuple: (changed, removed) where changed lists new or modified files and
+            removed lists files that are in the manifest but no longer on disk
+        """
+        changed = [path for path, file_hash in file_hashes.items()
+                   if self.files.get(path, {}).get("hash") != file_hash]
+        removed = [path for path in self.files if path not in file_hashes]
+        return changed, removed
+
+    def update(self, path, file_hash):
+        self.files[path] = {"hash": file_hash}
+
+    def remove(self, path):
+        self.files.pop(path, None)
+
+    def clear(self):
+        self.files = {}
+
+    def save(self):
+        """Writes the manifest atomically, so an interrupted run keeps the previous one."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump({"collection": self.collection_name, "files": self.files}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
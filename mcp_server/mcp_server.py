@@ -1,84 +1,262 @@
 from mcp.server.fastmcp import FastMCP
 import httpx
 import datetime
-from qdrant_client import QdrantClient, models
 from dotenv import load_dotenv
 load_dotenv()
 import os
-from openai import AzureOpenAI
-from model import ChunkModel
+import time
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+import asyncio
+import json
+from embedding_cache import EmbeddingCache, normalize_query
+from async_batching import MicroBatcher, SingleFlight
+from backends import SearchHit, chunk_source, create_embedder, create_vector_store
+from metrics import TraceWriter, instrument_tool, metrics, record_duration
+from mmr import mmr_select
+from context_window import merge_chunks, window_ranges
 
 
 # Create an MCP server
-mcp = FastMCP("RAG MCP Server", stateless_http=True, json_response=True)
-qdrant_url = os.environ["QDRANT_URL"]
-qdrant_client = QdrantClient(url=qdrant_url)
-
-collection_name = os.environ["QDRANT_COLLECTION_NAME"]
-azrue_client = AzureOpenAI(
-    api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-    azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-    api_key=os.environ["AZURE_OPENAI_API_KEY"]
+mcp = FastMCP(
+    "RAG MCP Server",
+    stateless_http=True,
+    json_response=True,
+    host=os.environ.get("MCP_SERVER_HOST", "127.0.0.1"),
+    port=int(os.environ.get("MCP_SERVER_PORT", "8000"))
 )
+# Qdrant and Azure OpenAI by default, see VECTOR_STORE and EMBEDDER for the local backends
+vector_store = create_vector_store()
+embedder = create_embedder()
+# Query embeddings are cached in memory and, if a path is configured, in a shared SQLite file
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", "3600")),
+    sqlite_path=os.environ.get("EMBEDDING_CACHE_PATH") or None,
+    max_disk_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_DISK_ENTRIES", "100000"))
+)
+# Query embeddings missing from the cache are collected for a few milliseconds and sent as one request
+embedding_batcher = MicroBatcher(
+    embedder.aembed,
+    max_batch_size=int(os.environ.get("QUERY_EMBEDDING_BATCH_SIZE", "64")),
+    max_wait_seconds=float(os.environ.get("QUERY_EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000
+)
+# Identical embeddings and searches already in flight are awaited instead of repeated
+embedding_flights = SingleFlight()
+search_flights = SingleFlight()
+# Payload fields get_rag_data_with_context returns unless the caller selects others
+DEFAULT_CHUNK_FIELDS = ("content", "filename", "chunknumber", "source_path")
+# With mmr, num_docs * MMR_CANDIDATES candidates are fetched with their vectors and reranked for diversity
+mmr_candidates = max(1, int(os.environ.get("MMR_CANDIDATES", "4")))
+# 1 ranks by relevance only, lower values trade relevance for diversity
+mmr_lambda = float(os.environ.get("MMR_LAMBDA", "0.5"))
+# Candidates at least this similar to an already selected chunk are dropped as near-duplicates
+mmr_duplicate_threshold = float(os.environ.get("MMR_DUPLICATE_THRESHOLD", "0.95"))
+# One JSON line per tool call with its latency split, if a path is configured
+trace_writer = TraceWriter(os.environ.get("MCP_TRACE_PATH") or None)
 
 # Get data from internal documents
 @mcp.tool()
-def get_rag_data(query: str, num_docs: int = 5) -> str:
-    """Get data from document knowledge based on the user query"""
+@instrument_tool(trace_writer)
+async def get_rag_data(query: str, num_docs: int = 5, mmr: bool = False) -> str:
+    """Get data from document knowledge based on the user query.
+
+    With mmr, redundant and near-duplicate chunks are replaced by diverse ones.
+    """
     print(f"Received MCP query at tool get_rag_data: {query}")
 
-    results = search_documents(query, num_docs)
-    combined_text = "\n\n".join([point.payload.get("content", "") for point in results.points])
+    results = await search_documents(query, num_docs, mmr=mmr)
+    combined_text = "\n\n".join([point.payload.get("content", "") for point in results])
     print(f"Query: {query}\n\nResults:\n\n{combined_text}")
 
     return combined_text
 
-@mcp.tool()
-def get_rag_data_with_context(query: str, num_docs: int = 5) -> str:
-    """Get data from document knowledge based on the user query"""
+# The tool returns one compact JSON text, structured output would send the same data a second time
+@mcp.tool(structured_output=False)
+@instrument_tool(trace_writer)
+async def get_rag_data_with_context(query: str, num_docs: int = 5, fields: list[str] | None = None,
+                                    max_content_chars: int | None = None, min_score: float | None = None,
+                                    mmr: bool = False, context_window: int = 0) -> str:
+    """Get data from document knowledge based on the user query.
+
+    Returns one JSON object with a list per field (columnar), e.g.
+    {"score": [...], "content": [...], "filename": [...], "chunknumber": [...], "source_path": [...]}.
+    fields selects the payload fields to return (default: content, filename, chunknumber, source_path),
+    max_content_chars truncates each content and chunks scoring below min_score are left out.
+    With mmr, redundant and near-duplicate chunks are replaced by diverse ones.
+    With context_window k, every hit is returned as a passage of the chunks chunknumber - k to
+    chunknumber + k of its file, overlapping passages are merged into one and the
+    first_chunknumber and last_chunknumber columns give the chunks a passage covers.
+    """
     print(f"Received MCP query at tool get_rag_data: {query}")
 
-    results = search_documents(query, num_docs)
-    #results = [
-    #        ChunkModel(content=point.payload.get("content", ""), filename=point.payload.get("filename", ""), chunknumber=point.payload.get("chunknumber", ""))
-    #        for point in results.points
-    #    ]
-    #print(f"Query: {query}\n\nResults:\n\n{combined_text}")
-
-    result_json = [
-        { 
-            "content": point.payload.get("content", ""),
-            "filename": point.payload.get("filename", ""),
-            "chunknumber": point.payload.get("chunknumber", ""),
-            "score": point.score 
-        }
-        for point in results.points
+    fields = list(fields) if fields else list(DEFAULT_CHUNK_FIELDS)
+    if context_window > 0:
+        # Passages are built from the neighbors' content, which are looked up by file and chunk number
+        payload_fields = list(dict.fromkeys([*fields, "content", "source_path", "filename", "chunknumber", "start_index"]))
+        results = await search_documents(query, num_docs, with_payload=payload_fields, score_threshold=min_score, mmr=mmr)
+        results = await expand_context(results, context_window, payload_fields)
+        fields += ["first_chunknumber", "last_chunknumber"]
+    else:
+        results = await search_documents(query, num_docs, with_payload=fields, score_threshold=min_score, mmr=mmr)
+    columns = {"score": [point.score for point in results]}
+    for field in fields:
+        values = [point.payload.get(field) for point in results]
+        if field == "content" and max_content_chars is not None:
+            values = [value[:max_content_chars] if isinstance(value, str) else value for value in values]
+        columns[field] = values
+    return json.dumps(columns, ensure_ascii=False, separators=(",", ":"))
+
+@mcp.tool()
+@instrument_tool(trace_writer)
+async def get_rag_data_batch(queries: list[str], num_docs: int = 5, deduplicate: bool = False, mmr: bool = False) -> dict:
+    """Get data from document knowledge for several queries at once.
+
+    With deduplicate, a chunk found by several queries is only returned for the query it scored best for.
+    With mmr, redundant and near-duplicate chunks of each query are replaced by diverse ones.
+    """
+    print(f"Received MCP queries at tool get_rag_data_batch: {queries}")
+
+    responses = await search_documents_batch(queries, num_docs, mmr=mmr)
+    results = [
+        [
+            {
+                "content": point.payload.get("content", ""),
+                "filename": point.payload.get("filename", ""),
+                "chunknumber": point.payload.get("chunknumber", ""),
+                "source_path": point.payload.get("source_path", ""),
+                "score": point.score
+            }
+            for point in response
+        ]
+        for response in responses
     ]
-    return result_json
-    
-def search_documents(query: str, num_docs: int = 5):
-    embedding_response = azrue_client.embeddings.create(
-        input=query,
-        model=os.environ["AZURE_OPENAI_EMBEDDING_MODEL"]
-    )
-    embedding = embedding_response.data[0].embedding
-    results = qdrant_client.query_points(
-        collection_name=collection_name,
-        query=embedding,
-        limit=num_docs,
-        with_payload=True
-    )
+    if deduplicate:
+        # Chunks are identified by source_path, equal filenames in different folders are different files
+        keys = [[(chunk_source(point.payload), point.payload.get("chunknumber")) for point in response]
+                for response in responses]
+        best = {}
+        for query_index, chunks in enumerate(results):
+            for key, chunk in zip(keys[query_index], chunks):
+                if key not in best or chunk["score"] > best[key][1]:
+                    best[key] = (query_index, chunk["score"])
+        results = [
+            [chunk for key, chunk in zip(keys[query_index], chunks) if best[key][0] == query_index]
+            for query_index, chunks in enumerate(results)
+        ]
+    return {"results": [{"query": query, "chunks": chunks} for query, chunks in zip(queries, results)]}
+
+@mcp.tool()
+@instrument_tool(trace_writer)
+def get_embedding_cache_stats() -> dict:
+    """Get hit-rate and latency counters of the query embedding cache"""
+    return embedding_cache.stats()
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def prometheus_metrics(request: Request) -> PlainTextResponse:
+    """Exposes the tool and cache metrics in the Prometheus text format."""
+    for key, value in embedding_cache.stats().items():
+        metrics.set_gauge("rag_embedding_cache", value, stat=key)
+    for key, value in embedding_batcher.stats().items():
+        metrics.set_gauge("rag_embedding_batches", value, stat=key)
+    for name, flights in (("embedding", embedding_flights), ("search", search_flights)):
+        metrics.set_gauge("rag_singleflight_calls", flights.calls, kind=name)
+        metrics.set_gauge("rag_singleflight_coalesced", flights.coalesced, kind=name)
+    if embedder.limiter is not None:
+        for key, value in embedder.limiter.stats().items():
+            metrics.set_gauge("rag_embedding_rate_limiter", value, stat=key)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def _embed_miss(query: str):
+    # Concurrent misses for the same normalized query share one slot in the next micro-batch
+    return await embedding_flights.do((embedder.model, normalize_query(query)), lambda: embedding_batcher.submit(query))
+
+async def embed_query(query: str):
+    """Embeds a query, cache hits skip the embedding request."""
+    start = time.perf_counter()
+    embedding = await embedding_cache.aget_or_embed(embedder.model, query, _embed_miss)
+    record_duration("embedding", time.perf_counter() - start)
+    return embedding
+
+async def embed_queries(queries: list[str]):
+    """Embeds several queries, all cache misses end up in the same micro-batch."""
+    start = time.perf_counter()
+    embeddings = await asyncio.gather(*(embedding_cache.aget_or_embed(embedder.model, query, _embed_miss) for query in queries))
+    record_duration("embedding", time.perf_counter() - start)
+    return list(embeddings)
+
+def rerank_diverse(embedding, results: list, num_docs: int) -> list:
+    """Picks num_docs diverse hits from candidates fetched with their vectors, see mmr.py."""
+    if not results:
+        return results
+    selected = mmr_select(embedding, [point.vector for point in results], num_docs,
+                          lambda_mult=mmr_lambda, duplicate_threshold=mmr_duplicate_threshold)
+    return [results[i] for i in selected]
+
+async def expand_context(results: list, window: int, payload_fields: list) -> list:
+    """Replaces the hits by passages of their neighbor chunks, fetched with one batched lookup."""
+    # Files are identified by source_path, equal filenames in different folders are different files
+    passages = window_ranges(
+        [(chunk_source(point.payload), point.payload.get("chunknumber"), point.score) for point in results], window)
+    start = time.perf_counter()
+    chunks = await vector_store.aget_chunks([(source, first, last) for source, first, last, _, _ in passages],
+                                            with_payload=payload_fields)
+    record_duration("search", time.perf_counter() - start)
+    contents = {(chunk_source(chunk), chunk.get("chunknumber")): (chunk.get("content", ""), chunk.get("start_index"))
+                for chunk in chunks}
+    hits = {(chunk_source(point.payload), point.payload.get("chunknumber")): point for point in results}
+    expanded = []
+    for source, first, last, chunknumber, score in passages:
+        # Windows reaching past the start or end of a file only cover the chunks that exist
+        numbers = [number for number in range(first, last + 1) if (source, number) in contents]
+        hit = hits[(source, chunknumber)]
+        payload = dict(hit.payload, content=merge_chunks([contents[(source, number)] for number in numbers]),
+                       first_chunknumber=numbers[0] if numbers else chunknumber,
+                       last_chunknumber=numbers[-1] if numbers else chunknumber)
+        expanded.append(SearchHit(hit.id, score, payload))
+    return expanded
+
+async def search_documents_batch(queries: list[str], num_docs: int = 5, mmr: bool = False):
+    """Searches for several queries with one batch query."""
+    if not queries:
+        return []
+    embeddings = await embed_queries(queries)
+    start = time.perf_counter()
+    if mmr:
+        candidates = await vector_store.asearch_batch(embeddings, num_docs * mmr_candidates, with_vectors=True)
+        results = [rerank_diverse(embedding, hits, num_docs) for embedding, hits in zip(embeddings, candidates)]
+    else:
+        results = await vector_store.asearch_batch(embeddings, num_docs)
+    record_duration("search", time.perf_counter() - start)
     return results
 
+async def _search(query: str, num_docs: int, with_payload, score_threshold, mmr):
+    embedding = await embed_query(query)
+    start = time.perf_counter()
+    if mmr:
+        candidates = await vector_store.asearch(embedding, num_docs * mmr_candidates, with_vectors=True,
+                                                with_payload=with_payload, score_threshold=score_threshold)
+        results = rerank_diverse(embedding, candidates, num_docs)
+    else:
+        results = await vector_store.asearch(embedding, num_docs, with_payload=with_payload, score_threshold=score_threshold)
+    record_duration("search", time.perf_counter() - start)
+    return results
+
+async def search_documents(query: str, num_docs: int = 5, with_payload=True, score_threshold: float = None,
+                           mmr: bool = False):
+    """Searches for a query, with_payload selects the payload fields as in Qdrant, mmr reranks for diversity."""
+    # Identical searches in flight are coalesced, the callers share the result list
+    key = (normalize_query(query), num_docs,
+           tuple(with_payload) if isinstance(with_payload, (list, tuple)) else with_payload, score_threshold, mmr)
+    return await search_flights.do(key, lambda: _search(query, num_docs, with_payload, score_threshold, mmr))
+
 if __name__ == "__main__":
-    # Check if Qdrant is reachable before starting the server
+    # Check if the vector store is reachable before starting the server
     try:
-        collections = qdrant_client.get_collections()
-        collection_names = [col.name for col in collections.collections]
-        if collection_name not in collection_names:
-            print(f"Error: Collection '{collection_name}' not found in Qdrant. Available collections: {collection_names}. Please create the collection before starting the server.")
+        if not vector_store.exists():
+            print(f"Error: Collection '{vector_store.name}' not found. Please create the collection before starting the server.")
             exit(1)
     except Exception as e:
-        print(f"Error: Could not connect to Qdrant at {qdrant_url}: {e}")
+        print(f"Error: Could not connect to the vector store '{vector_store.name}': {e}")
         exit(1)
     mcp.run(transport="streamable-http")
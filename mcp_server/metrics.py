@@ -0,0 +1,210 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+
+# Upper bounds of the latency histograms in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the response size histogram in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self._histograms:
+                self._histograms[key] = _Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    @staticmethod
+    def _labels(labels, extra=()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            described = set()
+
+            def header(name):
+                if name not in described and name in self._types:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {self._types[name]}")
+                    described.add(name)
+
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("rag_tool_requests_total", "counter", "Number of MCP tool calls")
+metrics.describe("rag_tool_errors_total", "counter", "Number of failed MCP tool calls")
+metrics.describe("rag_tool_duration_seconds", "histogram", "Wall time of MCP tool calls")
+metrics.describe("rag_tool_response_bytes", "histogram", "Size of the serialized MCP tool results")
+metrics.describe("rag_embedding_duration_seconds", "histogram", "Time spent embedding queries, including cache lookups")
+metrics.describe("rag_search_duration_seconds", "histogram", "Time spent in vector store searches")
+metrics.describe("rag_embedding_cache", "gauge", "Counters of the query embedding cache by stat")
+metrics.describe("rag_embedding_batches", "gauge", "Micro-batches of query embedding requests by stat")
+metrics.describe("rag_singleflight_calls", "gauge", "Embeddings and searches executed by kind")
+metrics.describe("rag_singleflight_coalesced", "gauge", "Embeddings and searches served from an identical call in flight by kind")
+
+
+class TraceWriter:
+    """Appends one JSON line per finished tool call to a file."""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, 'a', encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class _ToolSpan:
+    """Collects the timings of one tool call; embedding and search times are added by the helpers."""
+
+    def __init__(self):
+        self.embedding_seconds = 0.0
+        self.search_seconds = 0.0
+
+
+_current_span = contextvars.ContextVar("current_tool_span", default=None)
+
+
+def _response_size(result) -> int:
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    return len(json.dumps(result, default=str).encode("utf-8"))
+
+
+def record_duration(name: str, seconds: float):
+    """Records an embedding or search duration for the metrics and the current tool call's trace."""
+    metrics.observe(f"rag_{name}_duration_seconds", seconds)
+    span = _current_span.get()
+    if span is not None:
+        setattr(span, f"{name}_seconds", getattr(span, f"{name}_seconds") + seconds)
+
+
+def instrument_tool(trace_writer: TraceWriter = None):
+    """Decorator recording latency, response size and the embedding and search split of an MCP tool.
+
+    Place it below @mcp.tool(), FastMCP reads the tool's signature through functools.wraps.
+    """
+    def decorator(fn):
+        tool = fn.__name__
+
+        def start():
+            return _current_span.set(_ToolSpan()), time.perf_counter()
+
+        def finish(token, started, result=None, error=None):
+            elapsed = time.perf_counter() - started
+            span = _current_span.get()
+            _current_span.reset(token)
+            metrics.inc("rag_tool_requests_total", tool=tool)
+            metrics.observe("rag_tool_duration_seconds", elapsed, tool=tool)
+            record = {
+                "timestamp": time.time(),
+                "tool": tool,
+                "duration_seconds": round(elapsed, 6),
+                "embedding_seconds": round(span.embedding_seconds, 6),
+                "search_seconds": round(span.search_seconds, 6),
+            }
+            if error is None:
+                size = _response_size(result)
+                metrics.observe("rag_tool_response_bytes", size, buckets=SIZE_BUCKETS, tool=tool)
+                record["response_bytes"] = size
+            else:
+                metrics.inc("rag_tool_errors_total", tool=tool)
+                record["error"] = f"{type(error).__name__}: {error}"
+            if trace_writer is not None:
+                trace_writer.write(record)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                token, started = start()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    finish(token, started, error=e)
+                    raise
+                finish(token, started, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token, started = start()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                finish(token, started, error=e)
+                raise
+            finish(token, started, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+def mmr_select(query, vectors, k: int, lambda_mult: float = 0.5, duplicate_threshold: float = None) -> list:
+    """Returns the indices of up to k candidates chosen by maximal marginal relevance.
+
+    Every step picks the candidate maximizing
+    lambda_mult * sim(query, candidate) - (1 - lambda_mult) * max sim(candidate, selected),
+    so lambda_mult=1 keeps the relevance order and smaller values favour diversity. Candidates
+    with a cosine similarity of at least duplicate_threshold to a selected one are dropped, so
+    fewer than k indices are returned when the candidates are mostly near-duplicates.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if k <= 0 or len(vectors) == 0:
+        return []
+    query = np.asarray(query, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+    # All pairwise similarities in one product, the candidate sets are small
+    similarity = vectors @ vectors.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    # Highest similarity of every candidate to any selected one, updated per step
+    max_similarity = similarity[first].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[first] = False
+    while len(selected) < k:
+        if duplicate_threshold is not None:
+            available &= max_similarity < duplicate_threshold
+        if not available.any():
+            break
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
@@ -1,5 +1,9 @@
 class ChunkModel:
-    def __init__(self, filename: str, content: str, chunknumber: int):
+    def __init__(self, filename: str, content: str, chunknumber: int, source_path: str = None, start_index: int = None):
         self.filename = filename
         self.content = content
-        self.chunknumber = chunknumber
\ No newline at end of file
+        self.chunknumber = chunknumber
+        # Path of the source file, identifies the file across subfolders with equal filenames
+        self.source_path = source_path
+        # Character offset of the chunk in its file, neighbor chunks are merged by it
+        self.start_index = start_index